@@ -0,0 +1,249 @@
+"""Backfill shot descriptions and visual index embeddings with Bedrock batch inference.
+
+Usage:
+    export bucket_shots=... bucket_images=... region=us-east-1
+    export bedrock_llm=... text_embedding_model=... image_embedding_model=...
+    export aoss_host=... aoss_visual_index=vss-visual-index
+    python backfill/batch_backfill.py descriptions --jobs <jobId> ... --role-arn <arn>
+    python backfill/batch_backfill.py embeddings --jobs <jobId> ... --role-arn <arn>
+
+Offline, against local copies of the buckets (<root>/shots, <root>/images)
+and a fake model that answers every record locally:
+    python backfill/batch_backfill.py descriptions --jobs <jobId> --local-root ./buckets
+
+Model inputs are written as JSONL under backfill/<run id>/ in the shots
+bucket. Prompts, payloads and index documents come from the same common
+layer modules as generate_shot_desc and embedding_aoss.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "layers", "common"))
+
+from bedrock_payloads import (  # noqa: E402
+    build_description_model_input,
+    build_embedding_model_input,
+    build_shot_description_prompt,
+    parse_description_model_output,
+    parse_embedding_model_output,
+)
+from batch_jobs import (  # noqa: E402
+    BedrockBatchRunner,
+    LocalBatchRunner,
+    LocalObjectStore,
+    S3ObjectStore,
+    invoke_model_synchronously,
+)
+from shot_documents import build_shot_document, replace_shot_documents  # noqa: E402
+
+# Bedrock batch jobs need a minimum number of records; smaller runs are
+# answered with synchronous calls through the local runner instead
+BATCH_MIN_RECORDS = 100
+MAX_RECORDS_PER_FILE = 10000
+
+
+class JsonlWriter:
+    """Writes batch records into numbered JSONL files under a prefix."""
+
+    def __init__(self, store, prefix):
+        self.store = store
+        self.prefix = prefix
+        self.lines = []
+        self.file_count = 0
+        self.count = 0
+
+    def add(self, model_input):
+        # Bedrock record IDs are 11 alphanumeric characters
+        record_id = f"REC{self.count:08d}"
+        self.lines.append(json.dumps({"recordId": record_id, "modelInput": model_input}))
+        self.count += 1
+        if len(self.lines) >= MAX_RECORDS_PER_FILE:
+            self.flush()
+        return record_id
+
+    def flush(self):
+        if self.lines:
+            key = f"{self.prefix}/records-{self.file_count:04d}.jsonl"
+            self.store.put(key, "\n".join(self.lines) + "\n")
+            self.file_count += 1
+            self.lines = []
+
+
+def iter_shots(shots_store, job_ids):
+    for job_id in job_ids:
+        for key in sorted(shots_store.list(f"{job_id}/")):
+            # Shot records sit directly under the job prefix; subfolders such
+            # as map-results hold other JSON files
+            name = key[len(job_id) + 1 :]
+            if "/" not in name and name.endswith(".json"):
+                yield key, json.loads(shots_store.get(key))
+
+
+def run_batch(runners, run_id, name, model_id, writer):
+    writer.flush()
+    runner = runners["batch"] if writer.count >= BATCH_MIN_RECORDS else runners["local"]
+    print(f"{name}: {writer.count} records with {type(runner).__name__}")
+    outputs = {}
+    failed = 0
+    for record_id, model_output, error in runner.run(
+        f"vss-{name}-{run_id}", model_id, writer.prefix, f"backfill/{run_id}/{name}/output"
+    ):
+        if error:
+            logging.error(f"{name}: record {record_id} failed: {error}")
+            failed += 1
+        else:
+            outputs[record_id] = model_output
+    print(f"{name}: {len(outputs)} succeeded, {failed} failed")
+    return outputs
+
+
+def backfill_descriptions(shots_store, images_store, runners, run_id, job_ids):
+    model_id = os.environ["bedrock_llm"]
+    writer = JsonlWriter(shots_store, f"backfill/{run_id}/descriptions/input")
+    shot_keys = {}
+    for key, shot in iter_shots(shots_store, job_ids):
+        images = [
+            images_store.get(f"{shot['jobId']}/{frame['frame']}.png")
+            for frame in shot["shot_frames"]
+        ]
+        prompt = build_shot_description_prompt(shot["shot_frames"])
+        record_id = writer.add(build_description_model_input(model_id, prompt, images))
+        shot_keys[record_id] = key
+
+    outputs = run_batch(runners, run_id, "descriptions", model_id, writer)
+    for record_id, model_output in outputs.items():
+        key = shot_keys[record_id]
+        shot = json.loads(shots_store.get(key))
+        shot["shot_description"] = parse_description_model_output(model_id, model_output)
+        shots_store.put(key, json.dumps(shot).encode("utf-8"))
+
+
+def backfill_embeddings(shots_store, runners, run_id, job_ids, index_documents):
+    text_model_id = os.environ["text_embedding_model"]
+    image_model_id = os.environ["image_embedding_model"]
+    text_writer = JsonlWriter(shots_store, f"backfill/{run_id}/text-embeddings/input")
+    image_writer = JsonlWriter(shots_store, f"backfill/{run_id}/image-embeddings/input")
+    shots = []
+    for key, shot in iter_shots(shots_store, job_ids):
+        record_ids = {}
+        for field in ("shot_description", "shot_transcript"):
+            if shot[field].strip():
+                record_ids[field] = text_writer.add(
+                    build_embedding_model_input(text_model_id, text=shot[field])
+                )
+        composite_image = shots_store.get(f"{shot['jobId']}/{shot['shot_id']}.png")
+        record_ids["shot_image"] = image_writer.add(
+            build_embedding_model_input(
+                image_model_id, base64_image=base64.b64encode(composite_image).decode()
+            )
+        )
+        shots.append((shot, record_ids))
+
+    # The text and image jobs are independent and run side by side
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        text_future = executor.submit(
+            run_batch, runners, run_id, "text-embeddings", text_model_id, text_writer
+        )
+        image_future = executor.submit(
+            run_batch, runners, run_id, "image-embeddings", image_model_id, image_writer
+        )
+        text_outputs = text_future.result()
+        image_outputs = image_future.result()
+
+    indexed_shots, documents = [], []
+    for shot, record_ids in shots:
+        embeddings = {}
+        for field, record_id in record_ids.items():
+            outputs = image_outputs if field == "shot_image" else text_outputs
+            model_id = image_model_id if field == "shot_image" else text_model_id
+            if record_id in outputs:
+                embeddings[field] = parse_embedding_model_output(
+                    model_id, outputs[record_id], is_image=field == "shot_image"
+                )
+        if "shot_image" not in embeddings or len(embeddings) < len(record_ids):
+            logging.error(f"Skipping {shot['jobId']}/{shot['shot_id']}: missing embeddings")
+            continue
+        documents.append(
+            build_shot_document(
+                shot,
+                embeddings.get("shot_description"),
+                embeddings["shot_image"],
+                embeddings.get("shot_transcript"),
+            )
+        )
+        indexed_shots.append(shot)
+    index_documents(indexed_shots, documents)
+
+
+def fake_invoke(model_id, model_input):
+    # Deterministic stand-in outputs with the same shape as the real models
+    description = f"Backfilled description ({model_id})"
+    if "anthropic_version" in model_input:
+        return {"content": [{"type": "text", "text": description}]}
+    if "schemaVersion" in model_input:
+        return {"output": {"message": {"content": [{"text": description}]}}}
+    if "texts" in model_input:
+        return {"embeddings": [[0.0] * 1024 for _ in model_input["texts"]]}
+    return {"embedding": [0.0] * 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["descriptions", "embeddings"])
+    parser.add_argument("--jobs", nargs="+", required=True, help="job IDs to backfill")
+    parser.add_argument("--role-arn", help="service role for Bedrock batch inference")
+    parser.add_argument("--run-id", default=time.strftime("%Y%m%d%H%M%S"))
+    parser.add_argument(
+        "--local-root",
+        help="run offline against <root>/shots and <root>/images with a fake model",
+    )
+    args = parser.parse_args()
+
+    if args.local_root:
+        shots_store = LocalObjectStore(os.path.join(args.local_root, "shots"))
+        images_store = LocalObjectStore(os.path.join(args.local_root, "images"))
+        local_runner = LocalBatchRunner(fake_invoke, shots_store)
+        runners = {"batch": local_runner, "local": local_runner}
+
+        def index_documents(shots, documents):
+            lines = [json.dumps({"_source": document}) for document in documents]
+            shots_store.put(f"backfill/{args.run_id}/index/documents.jsonl", "\n".join(lines) + "\n")
+            print(f"wrote {len(documents)} documents")
+
+    else:
+        from aws_clients import get_client, get_opensearch_client
+
+        shots_store = S3ObjectStore(get_client("s3"), os.environ["bucket_shots"])
+        images_store = S3ObjectStore(get_client("s3"), os.environ["bucket_images"])
+        if not args.role_arn:
+            parser.error("--role-arn is required unless --local-root is set")
+        runners = {
+            "batch": BedrockBatchRunner(get_client("bedrock"), args.role_arn, shots_store),
+            "local": LocalBatchRunner(
+                invoke_model_synchronously(get_client("bedrock-runtime")), shots_store
+            ),
+        }
+
+        def index_documents(shots, documents):
+            client = get_opensearch_client(os.environ["aoss_host"], os.environ["region"])
+            failed = replace_shot_documents(
+                client, os.environ["aoss_visual_index"], shots, documents
+            )
+            print(f"indexed {len(documents) - len(failed)} of {len(documents)} documents")
+
+    if args.mode == "descriptions":
+        backfill_descriptions(shots_store, images_store, runners, args.run_id, args.jobs)
+    else:
+        backfill_embeddings(shots_store, runners, args.run_id, args.jobs, index_documents)
+
+
+if __name__ == "__main__":
+    main()
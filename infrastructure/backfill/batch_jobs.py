@@ -0,0 +1,155 @@
+"""Object stores and batch inference runners used by the backfill.
+
+BedrockBatchRunner submits Bedrock batch inference jobs. LocalBatchRunner is
+a stand-in that reads the same JSONL input, calls an invoke function per
+record and writes output files in the Bedrock batch format, so the backfill
+can run offline against a local directory and a fake model.
+"""
+
+import json
+import logging
+import os
+import time
+
+BATCH_POLL_SECONDS = 60
+BATCH_TERMINAL_STATUSES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+BATCH_OUTPUT_SUFFIX = ".jsonl.out"
+
+
+class S3ObjectStore:
+    def __init__(self, s3_client, bucket):
+        self.s3_client = s3_client
+        self.bucket = bucket
+
+    def uri(self, key):
+        return f"s3://{self.bucket}/{key}"
+
+    def get(self, key):
+        return self.s3_client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+    def put(self, key, data):
+        self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def iter_lines(self, key):
+        # Batch outputs can be large; stream them instead of reading them whole
+        body = self.s3_client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        for line in body.iter_lines():
+            if line:
+                yield line
+
+    def list(self, prefix):
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"]
+
+
+class LocalObjectStore:
+    def __init__(self, root):
+        self.root = root
+
+    def uri(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        with open(self.uri(key), "rb") as f:
+            return f.read()
+
+    def put(self, key, data):
+        os.makedirs(os.path.dirname(self.uri(key)), exist_ok=True)
+        with open(self.uri(key), "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+
+    def iter_lines(self, key):
+        with open(self.uri(key), "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+    def list(self, prefix):
+        for directory, _, files in os.walk(self.root):
+            for file_name in files:
+                key = os.path.relpath(os.path.join(directory, file_name), self.root)
+                if key.startswith(prefix):
+                    yield key
+
+
+def iter_batch_outputs(store, output_prefix):
+    """Yields (record_id, model_output, error) from every output file."""
+    for key in sorted(store.list(output_prefix)):
+        if not key.endswith(BATCH_OUTPUT_SUFFIX):
+            continue
+        for line in store.iter_lines(key):
+            record = json.loads(line)
+            yield record["recordId"], record.get("modelOutput"), record.get("error")
+
+
+class BedrockBatchRunner:
+    def __init__(self, bedrock_client, role_arn, store, poll_seconds=BATCH_POLL_SECONDS):
+        self.bedrock_client = bedrock_client
+        self.role_arn = role_arn
+        self.store = store
+        self.poll_seconds = poll_seconds
+
+    def run(self, job_name, model_id, input_prefix, output_prefix):
+        response = self.bedrock_client.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=self.role_arn,
+            modelId=model_id,
+            inputDataConfig={
+                "s3InputDataConfig": {
+                    "s3Uri": self.store.uri(input_prefix),
+                    "s3InputFormat": "JSONL",
+                }
+            },
+            outputDataConfig={"s3OutputDataConfig": {"s3Uri": self.store.uri(output_prefix)}},
+        )
+        job_arn = response["jobArn"]
+        while True:
+            job = self.bedrock_client.get_model_invocation_job(jobIdentifier=job_arn)
+            if job["status"] in BATCH_TERMINAL_STATUSES:
+                break
+            print(f"{job_name}: {job['status']}")
+            time.sleep(self.poll_seconds)
+        if job["status"] not in ("Completed", "PartiallyCompleted"):
+            raise RuntimeError(f"Batch job {job_name} ended as {job['status']}: {job.get('message')}")
+        return iter_batch_outputs(self.store, output_prefix)
+
+
+class LocalBatchRunner:
+    """Runs a batch job in-process; invoke(model_id, model_input) returns the model output."""
+
+    def __init__(self, invoke, store):
+        self.invoke = invoke
+        self.store = store
+
+    def run(self, job_name, model_id, input_prefix, output_prefix):
+        for key in sorted(self.store.list(input_prefix)):
+            if not key.endswith(".jsonl"):
+                continue
+            lines = []
+            for line in self.store.iter_lines(key):
+                record = json.loads(line)
+                output = {"recordId": record["recordId"], "modelInput": record["modelInput"]}
+                try:
+                    output["modelOutput"] = self.invoke(model_id, record["modelInput"])
+                except Exception as e:
+                    logging.error(f"{job_name}: record {record['recordId']} failed: {e}")
+                    output["error"] = {"errorMessage": str(e)}
+                lines.append(json.dumps(output))
+            output_key = f"{output_prefix}/{job_name}/{os.path.basename(key)}.out"
+            self.store.put(output_key, "\n".join(lines) + "\n")
+        return iter_batch_outputs(self.store, output_prefix)
+
+
+def invoke_model_synchronously(bedrock_runtime_client):
+    def invoke(model_id, model_input):
+        response = bedrock_runtime_client.invoke_model(
+            body=json.dumps(model_input),
+            modelId=model_id,
+            accept="application/json",
+            contentType="application/json",
+        )
+        return json.loads(response["body"].read())
+
+    return invoke
@@ -0,0 +1,141 @@
+"""Export a visual index from the AOSS collection into a NumPy search snapshot.
+
+Usage:
+    export aoss_host=... region=us-east-1
+    python benchmarks/export_vector_snapshot.py --index vss-visual-index \
+        --output snapshots/vss-visual-index --ivf-lists 256
+    aws s3 sync snapshots s3://<images bucket>/vector-snapshots --exclude "*manifest.json"
+    aws s3 sync snapshots s3://<images bucket>/vector-snapshots
+
+The search function serves the snapshot when search_backend=numpy and
+vector_snapshot_uri points at the synced prefix (or a local directory).
+Warm containers check the manifest every vector_snapshot_check_seconds and
+load a re-exported snapshot once it changes, so the manifest goes up last.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "layers", "common"))
+sys.path.insert(0, os.path.join(ROOT, "functions", "search"))
+
+from aws_clients import get_opensearch_client  # noqa: E402
+from vector_store import write_snapshot  # noqa: E402
+
+VECTOR_FIELDS = ["shot_image_vector", "shot_desc_vector", "shot_transcript_vector"]
+PAGE_SIZE = 500
+# search_after sort key; jobId and shot_id together identify a shot
+SORT_FIELDS = ["jobId", "shot_id"]
+# Indexes created without the keyword sub-fields can only be paged with
+# from/size, which is bounded by the index max_result_window
+MAX_FROM_SIZE_DOCUMENTS = 10000
+
+
+def has_sort_fields(client, index):
+    mapping = next(iter(client.indices.get_mapping(index=index).values()))
+    properties = mapping["mappings"]["properties"]
+    return all(
+        "keyword" in properties.get(field, {}).get("fields", {}) for field in SORT_FIELDS
+    )
+
+
+def iter_hits_search_after(client, index):
+    body = {
+        "size": PAGE_SIZE,
+        "query": {"match_all": {}},
+        "sort": [{f"{field}.keyword": "asc"} for field in SORT_FIELDS],
+    }
+    while True:
+        hits = client.search(index=index, body=body)["hits"]["hits"]
+        yield from hits
+        if len(hits) < PAGE_SIZE:
+            return
+        body["search_after"] = hits[-1]["sort"]
+
+
+def iter_hits_from_size(client, index):
+    for start in range(0, MAX_FROM_SIZE_DOCUMENTS, PAGE_SIZE):
+        response = client.search(
+            index=index,
+            body={
+                "from": start,
+                "size": PAGE_SIZE,
+                "track_total_hits": True,
+                "query": {"match_all": {}},
+            },
+        )
+        total = response["hits"]["total"]["value"]
+        if total > MAX_FROM_SIZE_DOCUMENTS:
+            # A partial snapshot would silently drop shots from search results
+            sys.exit(
+                f"{index} has {total} documents, more than the {MAX_FROM_SIZE_DOCUMENTS} "
+                "from/size paging can reach; recreate it with the jobId.keyword and "
+                "shot_id.keyword sub-fields of the current mapping to export it"
+            )
+        hits = response["hits"]["hits"]
+        yield from hits
+        if len(hits) < PAGE_SIZE:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index", required=True)
+    parser.add_argument("--output", required=True, help="snapshot directory")
+    parser.add_argument("--dtype", default="float16", choices=["float16", "float32"])
+    parser.add_argument("--ivf-lists", type=int, default=0, help="0 disables IVF")
+    args = parser.parse_args()
+
+    client = get_opensearch_client(os.environ["aoss_host"], os.environ["region"])
+    if has_sort_fields(client, args.index):
+        hits = iter_hits_search_after(client, args.index)
+    else:
+        hits = iter_hits_from_size(client, args.index)
+    ids, sources, vectors = [], [], {field: [] for field in VECTOR_FIELDS}
+    for hit in hits:
+        source = hit["_source"]
+        ids.append(hit["_id"])
+        for field in VECTOR_FIELDS:
+            # Shots without speech or a description have no vector for it
+            vectors[field].append(source.pop(field, None))
+        sources.append(source)
+
+    total = client.count(index=args.index)["count"]
+    if total != len(ids):
+        # Documents indexed twice for a shot share a sort key and can be
+        # skipped between pages
+        print(f"warning: exported {len(ids)} of {total} documents in {args.index}")
+
+    columns = sorted({column for source in sources for column in source})
+    metadata = {column: [source.get(column) for source in sources] for column in columns}
+    matrices, present = {}, {}
+    for field, rows in vectors.items():
+        dimensions = {len(row) for row in rows if row is not None}
+        if not dimensions:
+            print(f"skipping {field}: no document has it")
+            continue
+        # Missing vectors are stored as zero rows and masked out at search time
+        matrix = np.zeros((len(rows), dimensions.pop()), dtype=np.float32)
+        for row, vector in enumerate(rows):
+            if vector is not None:
+                matrix[row] = vector
+        matrices[field] = matrix
+        present[field] = np.array([row is not None for row in rows], dtype=bool)
+    write_snapshot(
+        args.output,
+        ids,
+        metadata,
+        matrices,
+        dtype=args.dtype,
+        ivf_lists=args.ivf_lists,
+        present=present,
+    )
+    print(f"exported {len(ids)} documents from {args.index} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
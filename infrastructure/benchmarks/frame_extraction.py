@@ -0,0 +1,107 @@
+"""Compare single-pass and per-timestamp frame extraction on a local video.
+
+Usage:
+    python benchmarks/frame_extraction.py --video sample.mp4 --shots 500 --ffmpeg ffmpeg
+
+Shots are spread evenly over the video and, like shot detection, each
+contributes its first, middle and last timestamp. Both engines write their
+frames to separate directories, which are then compared pixel by pixel.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "functions", "rekognition_shot_detection_sns"))
+
+from frame_extraction import (  # noqa: E402
+    extract_frames,
+    extract_frames_per_timestamp,
+    extract_frames_single_pass,
+    frame_path,
+)
+from PIL import Image, ImageChops  # noqa: E402
+
+
+def video_duration_ms(ffmpeg_path, video_path):
+    output = subprocess.run(
+        [ffmpeg_path, "-hide_banner", "-i", video_path], capture_output=True, text=True
+    ).stderr
+    hours, minutes, seconds = re.search(r"Duration: (\d+):(\d+):([\d.]+)", output).groups()
+    return int((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+
+
+def shot_timestamps(duration_ms, shots, frames_per_shot=3):
+    timestamps = []
+    for i in range(shots):
+        start_time = i * duration_ms // shots
+        end_time = (i + 1) * duration_ms // shots - 40
+        step = int((end_time - start_time) / (frames_per_shot - 1))
+        timestamps.extend(start_time + j * step for j in range(frames_per_shot))
+    return timestamps
+
+
+def compare_frames(timestamps, expected_dir, actual_dir):
+    identical, different, missing = 0, 0, 0
+    for timestamp_ms in sorted(set(timestamps)):
+        expected_path = frame_path(expected_dir, timestamp_ms)
+        actual_path = frame_path(actual_dir, timestamp_ms)
+        if not os.path.exists(expected_path) or not os.path.exists(actual_path):
+            missing += 1
+            continue
+        with Image.open(expected_path) as expected, Image.open(actual_path) as actual:
+            if expected.size == actual.size and not ImageChops.difference(
+                expected.convert("RGB"), actual.convert("RGB")
+            ).getbbox():
+                identical += 1
+            else:
+                different += 1
+    return identical, different, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--video", required=True)
+    parser.add_argument("--shots", type=int, default=200)
+    parser.add_argument("--ffmpeg", default="/opt/bin/ffmpeg")
+    parser.add_argument("--max-passes", type=int, help="parallel decoding passes")
+    args = parser.parse_args()
+
+    duration_ms = video_duration_ms(args.ffmpeg, args.video)
+    timestamps = shot_timestamps(duration_ms, args.shots)
+    print(f"{len(timestamps)} timestamps over {duration_ms / 1000:.1f} s of video")
+
+    with tempfile.TemporaryDirectory() as per_timestamp_dir, tempfile.TemporaryDirectory() as single_pass_dir:
+        start = time.perf_counter()
+        extract_frames_per_timestamp(args.ffmpeg, args.video, timestamps, per_timestamp_dir)
+        per_timestamp_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        remaining = extract_frames_single_pass(
+            args.ffmpeg, args.video, timestamps, single_pass_dir, args.max_passes
+        )
+        passes_seconds = time.perf_counter() - start
+        extract_frames_per_timestamp(
+            args.ffmpeg, args.video, remaining, single_pass_dir, last_timestamp=max(timestamps)
+        )
+        single_pass_seconds = time.perf_counter() - start
+
+        print(f"per-timestamp: {per_timestamp_seconds:8.2f} s")
+        print(
+            f"single-pass:   {single_pass_seconds:8.2f} s "
+            f"({passes_seconds:.2f} s in passes, {len(remaining)} timestamps fell back)"
+        )
+        print(f"speedup:       {per_timestamp_seconds / single_pass_seconds:8.2f}x")
+        identical, different, missing = compare_frames(
+            timestamps, per_timestamp_dir, single_pass_dir
+        )
+        print(f"frames: {identical} identical, {different} different, {missing} missing")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare brute-force and approximate k-NN text search against a deployed visual index.
+
+Usage:
+    export aoss_host=... aoss_visual_index=vss-visual-index region=us-east-1
+    export text_embedding_model=cohere.embed-english-v3
+    python benchmarks/text_search.py --queries queries.txt --runs 5
+
+Each query is embedded once; only the OpenSearch stage is timed so that the
+numbers reflect the query strategy rather than Bedrock latency.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "layers", "common"))
+sys.path.insert(0, os.path.join(ROOT, "functions", "search"))
+
+import app  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def time_call(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", required=True, help="file with one query per line")
+    parser.add_argument("--runs", type=int, default=5, help="repetitions per query")
+    parser.add_argument("--k", type=int, default=app.MAX_RERANK_RESULTS, help="recall@k cut-off")
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    index = os.environ["aoss_visual_index"]
+    client = app.get_opensearch_client(os.environ["aoss_host"], os.environ["region"])
+
+    latencies = {"exact": [], "knn": []}
+    recalls = []
+    for query in queries:
+        embedding = app.get_text_embedding(os.environ["text_embedding_model"], query)
+        for _ in range(args.runs):
+            exact_ms, exact_hits = time_call(
+                app.get_exact_text_hits, index, client, embedding, query
+            )
+            knn_ms, knn_hits = time_call(
+                app.get_knn_text_hits, index, client, embedding, query
+            )
+            latencies["exact"].append(exact_ms)
+            latencies["knn"].append(knn_ms)
+
+        exact_ids = [hit["_id"] for hit in exact_hits[: args.k]]
+        knn_ids = {hit["_id"] for hit in knn_hits[: args.k]}
+        if exact_ids:
+            recalls.append(len(knn_ids.intersection(exact_ids)) / len(exact_ids))
+
+    print(f"queries={len(queries)} runs={args.runs} k={args.k}")
+    for mode, values in latencies.items():
+        print(
+            f"{mode:>6}: p50={percentile(values, 50):8.1f} ms  "
+            f"p99={percentile(values, 99):8.1f} ms  mean={statistics.mean(values):8.1f} ms"
+        )
+    if recalls:
+        print(f"recall@{args.k} (knn vs exact): {statistics.mean(recalls):.3f}")
+
+
+if __name__ == "__main__":
+    main()
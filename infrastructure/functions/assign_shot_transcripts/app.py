@@ -0,0 +1,42 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import get_client
+from shot_batches import read_shot_manifest
+from shot_transcripts import TranscriptIndex, shot_id_for, shot_transcript_key
+
+s3_client = get_client("s3")
+
+MAX_UPLOAD_WORKERS = 16
+
+
+def lambda_handler(event, context):
+    bucket_shots = os.environ["bucket_shots"]
+    bucket_transcripts = os.environ["bucket_transcripts"]
+    jobId = event[0]["jobId"]
+    shot_manifest = event[1]["RekognitionShotDetectionParams"]["ShotManifest"]
+    shots = list(read_shot_manifest(s3_client, shot_manifest["Bucket"], shot_manifest["Key"]))
+
+    transcript = json.loads(
+        s3_client.get_object(Bucket=bucket_transcripts, Key=jobId + ".json")["Body"]
+        .read()
+        .decode("utf-8-sig")
+    )
+    transcript_index = TranscriptIndex(transcript)
+
+    def put_shot_transcript(shot):
+        shot_id = shot_id_for(shot["shot_startTime"], shot["shot_endTime"])
+        shot_transcript = transcript_index.shot_transcript(
+            shot["shot_startTime"], shot["shot_endTime"]
+        )
+        s3_client.put_object(
+            Body=shot_transcript.encode("utf-8"),
+            Bucket=bucket_shots,
+            Key=shot_transcript_key(jobId, shot_id),
+            ContentType="text/plain",
+        )
+
+    with ThreadPoolExecutor(max_workers=MAX_UPLOAD_WORKERS) as executor:
+        list(executor.map(put_shot_transcript, shots))
+
+    return {"jobId": jobId, "shots": len(shots)}
@@ -8,9 +8,9 @@ import datetime
 import time
 import uuid
 import random
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from aws_clients import get_client, get_opensearch_client, get_resource
 
-sqs_client = boto3.client("sqs")
+sqs_client = get_client("sqs")
 
 
 def lambda_handler(event, context):
@@ -26,7 +26,7 @@ def lambda_handler(event, context):
 
     jobId = response["MessageId"]
 
-    dynamodb = boto3.resource("dynamodb")
+    dynamodb = get_resource("dynamodb")
     table = dynamodb.Table(os.environ["vss_dynamodb_table"])
     status = str(random.randint(1, 25)) + "%"
     started = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -68,32 +68,11 @@ def lambda_handler(event, context):
     except Exception as e:
         logging.error(f"An error occurred: {e}")
 
-    try:
-        create_shot_collection(
-            os.environ["aoss_host"],
-            os.environ["region"],
-            jobId,
-            os.environ["image_embedding_dimension"],
-        )
-    except Exception as e:
-        logging.error(f"An error occurred: {e}")
-
     return {"statusCode": 200, "body": json.dumps(response)}
 
 
 def create_visual_index(host, region, index, len_embedding):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
+    client = get_opensearch_client(host, region)
 
     exist = client.indices.exists(index=index)
     if not exist:
@@ -101,9 +80,10 @@ def create_visual_index(host, region, index, len_embedding):
         index_body = {
             "mappings": {
                 "properties": {
-                    "jobId": {"type": "text"},
+                    # keyword sub-fields give snapshot exports a sort key
+                    "jobId": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
                     "video_name": {"type": "text"},
-                    "shot_id": {"type": "text"},
+                    "shot_id": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
                     "shot_startTime": {"type": "text"},
                     "shot_endTime": {"type": "text"},
                     "shot_description": {"type": "text"},
@@ -155,18 +135,7 @@ def create_visual_index(host, region, index, len_embedding):
     return client
 
 def create_audio_index(host, region, index, len_embedding):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
+    client = get_opensearch_client(host, region)
 
     exist = client.indices.exists(index=index)
     if not exist:
@@ -203,55 +172,3 @@ def create_audio_index(host, region, index, len_embedding):
         response = client.indices.create(index=index, body=index_body)
 
     return client
-
-
-def create_shot_collection(host, region, index, len_embedding):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
-
-    exist = client.indices.exists(index=index)
-    if not exist:
-        print("Creating temporary shot collection index")
-        index_body = {
-            "mappings": {
-                "properties": {
-                    "jobId": {"type": "text"},
-                    "video_name": {"type": "text"},
-                    "shot_id": {"type": "text"},
-                    "shot_startTime": {"type": "text"},
-                    "shot_endTime": {"type": "text"},
-                    "frame_publicFigures": {"type": "text"},
-                    "frame_privateFigures": {"type": "text"},
-                    "frame_image_vector": {
-                        "type": "knn_vector",
-                        "dimension": len_embedding,
-                        "method": {
-                            "engine": "nmslib",
-                            "space_type": "cosinesimil",
-                            "name": "hnsw",
-                            "parameters": {"ef_construction": 512, "m": 16},
-                        },
-                    },
-                }
-            },
-            "settings": {
-                "index": {
-                    "number_of_shards": 2,
-                    "knn.algo_param": {"ef_search": 512},
-                    "knn": True,
-                }
-            },
-        }
-        response = client.indices.create(index=index, body=index_body)
-
-    return client
@@ -8,54 +8,85 @@ import datetime
 import time
 import uuid
 import random
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from aws_clients import get_client
+from bedrock_embeddings import embed_frame
+from frame_vectors import encode_frame_vectors, shot_vectors_key
+from embedding_cache import create_frame_cache
+from shot_batches import map_shots, shot_items
 import base64
 
-bedrock_client = boto3.client(service_name="bedrock-runtime")
-s3_client = boto3.client("s3")
+bedrock_client = get_client("bedrock-runtime")
+s3_client = get_client("s3")
+frame_cache = create_frame_cache()
 
 def lambda_handler(event, context):
-    bucket_images = os.environ["bucket_images"]
-    bucket_shots = os.environ["bucket_shots"]
-    jobId = event[0]["jobId"]
-    video_name = event[0]["video_name"]
-    shot_id = event[0]["shot_id"]
-    shot_startTime = event[0]["shot_startTime"]
-    shot_endTime = event[0]["shot_endTime"]
+    # The two branches of the detection Parallel state, shot by shot
+    celebrities, is_batch = shot_items(event[0])
+    other_figures, _ = shot_items(event[1])
+    results = map_shots(store_shot, {"Items": list(zip(celebrities, other_figures))})
+    return results if is_batch else results["Items"][0]
+
+
+def store_shot(detections):
+    celebrities, other_figures = detections
     shot_frames = []
 
-    for index in range(len(event[0]["shot_frames"])):
+    for index in range(len(celebrities["shot_frames"])):
         shot_frames.append(
             {
-                "frame": event[0]["shot_frames"][index]["frame"],
-                "frame_publicFigures": event[0]["shot_frames"][index]["frame_publicFigures"],
-                "frame_privateFigures": event[1]["shot_frames"][index]["frame_privateFigures"],
+                "frame": celebrities["shot_frames"][index]["frame"],
+                "frame_publicFigures": celebrities["shot_frames"][index]["frame_publicFigures"],
+                "frame_privateFigures": other_figures["shot_frames"][index]["frame_privateFigures"],
             }
         )
-    
-    client = get_opensearch_client(os.environ["aoss_host"], os.environ["region"])
 
+    return save_shot_collection(celebrities, shot_frames)
+
+
+def save_shot_collection(shot, shot_frames, frame_images=None):
+    """Writes the shot's frame vectors and metadata.
+
+    frame_images optionally holds the frame bytes already read, in frame order.
+    """
+    bucket_images = os.environ["bucket_images"]
+    bucket_shots = os.environ["bucket_shots"]
+    jobId = shot["jobId"]
+    video_name = shot["video_name"]
+    shot_id = shot["shot_id"]
+    shot_startTime = shot["shot_startTime"]
+    shot_endTime = shot["shot_endTime"]
+
+    # Frames with a detected figure are kept for identity matching across the job
+    figure_frames = []
+    embeddings = []
     for index, value in enumerate(shot_frames):
         if value["frame_publicFigures"] != "" or value["frame_privateFigures"] != "":
-            embedding = get_titan_image_embedding(
-                bucket_images, jobId, os.environ["image_embedding_model"], f"{value["frame"]}.png"
-            )
-            embedding_request_body = json.dumps(
+            if frame_images:
+                embedding = embed_frame(
+                    bedrock_client,
+                    frame_cache,
+                    os.environ["image_embedding_model"],
+                    frame_images[index],
+                )
+            else:
+                embedding = get_titan_image_embedding(
+                    bucket_images, jobId, os.environ["image_embedding_model"], value["frame"] + ".png"
+                )
+            figure_frames.append(
                 {
-                    "jobId": jobId,
-                    "video_name": video_name,
-                    "shot_startTime": shot_startTime,
-                    "shot_endTime": shot_endTime,
+                    "shot_id": shot_id,
+                    "frame": value["frame"],
                     "frame_publicFigures": value["frame_publicFigures"],
                     "frame_privateFigures": value["frame_privateFigures"],
-                    "frame_image_vector": embedding,
                 }
             )
-            response = client.index(
-                index=jobId,
-                body=embedding_request_body,
-                params={"timeout": 60},
-            )
+            embeddings.append(embedding)
+
+    s3_client.put_object(
+        Body=encode_frame_vectors(figure_frames, embeddings),
+        Bucket=bucket_shots,
+        Key=shot_vectors_key(jobId, shot_id),
+    )
 
     shot =  {
         "jobId": jobId,
@@ -86,35 +117,7 @@ def lambda_handler(event, context):
 def get_titan_image_embedding(bucket_images, jobId, embedding_model, image_name):
     s3_object = s3_client.get_object(Bucket=bucket_images, Key=f"{jobId}/{image_name}")
     image_content = s3_object['Body'].read()
-    base64_image_string = base64.b64encode(image_content).decode()
-
-    accept = "application/json"
-    content_type = "application/json"
-    body = json.dumps(
-        {"inputImage": base64_image_string}
-    )
-    response = bedrock_client.invoke_model(
-        body=body, modelId=embedding_model, accept=accept, contentType=content_type
-    )
-    response_body = json.loads(response["body"].read())
-    embedding = response_body.get("embedding")
-    return embedding
-
-def get_opensearch_client(host, region):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
-
-    return client
+    return embed_frame(bedrock_client, frame_cache, embedding_model, image_content)
 
 def milliseconds_to_time_format(ms):
     return "{:02d}:{:02d}:{:02d}:{:03d}".format(
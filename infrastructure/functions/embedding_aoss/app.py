@@ -5,63 +5,95 @@ import boto3
 from botocore.exceptions import ClientError
 import os
 import time
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import get_client, get_opensearch_client
+from bedrock_embeddings import embed_texts
+from shot_batches import shot_items
+from shot_documents import build_shot_document, replace_shot_documents
 import base64
 
-bedrock_client = boto3.client(service_name="bedrock-runtime")
-s3_client = boto3.client("s3")
+bedrock_client = get_client("bedrock-runtime")
+s3_client = get_client("s3")
+
+
+MAX_IMAGE_EMBEDDING_WORKERS = 8
 
 
 def lambda_handler(event, context):
+    # Accepts a single shot or a batch of shots, either as a list or as the
+    # {"Items": [...]} payload produced by a Map state ItemBatcher
+    shots, _ = shot_items(event)
+
     bucket_shots = os.environ["bucket_shots"]
-    jobId = event["jobId"]
-    video_name = event["video_name"]
-    shot_id = event["shot_id"]
-    shot_startTime = event["shot_startTime"]
-    shot_endTime = event["shot_endTime"]
-    (
-        shot_frames,
-        shot_description,
-        shot_publicFigures,
-        shot_privateFigures,
-        shot_transcript,
-    ) = get_shot_metadata(bucket_shots, jobId, shot_id)
-
-    shot_desc_embedding = get_text_embedding(
-        os.environ["text_embedding_model"], shot_description
-    )
-    shot_image_embedding = get_image_embedding(bucket_shots, jobId, shot_id)
-    shot_transcript_embedding = get_text_embedding(
-        os.environ["text_embedding_model"], shot_transcript
-    )
+    with ThreadPoolExecutor(max_workers=MAX_IMAGE_EMBEDDING_WORKERS) as executor:
+        shot_metadata = list(
+            executor.map(
+                lambda shot: get_shot_metadata(bucket_shots, shot["jobId"], shot["shot_id"]),
+                shots,
+            )
+        )
 
-    aoss_request_body = json.dumps(
-        {
-            "jobId": jobId,
-            "video_name": video_name,
-            "shot_id": shot_id,
-            "shot_startTime": shot_startTime,
-            "shot_endTime": shot_endTime,
-            "shot_description": shot_description,
-            "shot_publicFigures": shot_publicFigures,
-            "shot_privateFigures": shot_privateFigures,
-            "shot_transcript": shot_transcript,
-            "shot_desc_vector": shot_desc_embedding,
-            "shot_image_vector": shot_image_embedding,
-            "shot_transcript_vector": shot_transcript_embedding,
-        }
-    )
+    index_shots(shots, shot_metadata)
 
-    documentId = f"{video_name}-{shot_id}"
-    client = get_opensearch_client(os.environ["aoss_host"], os.environ["region"])
+    return {"status": 200}
 
-    response = client.index(
-        index=os.environ["aoss_visual_index"],
-        body=aoss_request_body,
-        params={"timeout": 60},
-    )
 
-    return {"status": 200}
+def index_shots(shots, shot_metadata):
+    """Embeds and indexes shots given the metadata tuples of get_shot_metadata."""
+    bucket_shots = os.environ["bucket_shots"]
+    with ThreadPoolExecutor(max_workers=MAX_IMAGE_EMBEDDING_WORKERS) as executor:
+        # Images are embedded one per request while all description and
+        # non-empty transcript texts go out together as batched text requests
+        image_futures = [
+            executor.submit(get_image_embedding, bucket_shots, shot["jobId"], shot["shot_id"])
+            for shot in shots
+        ]
+        texts = [
+            text
+            for metadata in shot_metadata
+            for text in (metadata[1], metadata[4])
+            if text.strip()
+        ]
+        text_embeddings = iter(
+            embed_texts(
+                bedrock_client,
+                os.environ["text_embedding_model"],
+                texts,
+                max_workers=MAX_IMAGE_EMBEDDING_WORKERS,
+            )
+        )
+        shot_image_embeddings = [future.result() for future in image_futures]
+
+    documents = []
+    for shot, metadata, shot_image_embedding in zip(shots, shot_metadata, shot_image_embeddings):
+        (
+            shot_frames,
+            shot_description,
+            shot_publicFigures,
+            shot_privateFigures,
+            shot_transcript,
+        ) = metadata
+        shot_desc_embedding = next(text_embeddings) if shot_description.strip() else None
+        shot_transcript_embedding = (
+            next(text_embeddings) if shot_transcript.strip() else None
+        )
+        shot = dict(
+            shot,
+            shot_description=shot_description,
+            shot_publicFigures=shot_publicFigures,
+            shot_privateFigures=shot_privateFigures,
+            shot_transcript=shot_transcript,
+        )
+        documents.append(
+            build_shot_document(
+                shot, shot_desc_embedding, shot_image_embedding, shot_transcript_embedding
+            )
+        )
+
+    client = get_opensearch_client(os.environ["aoss_host"], os.environ["region"])
+    failed = replace_shot_documents(client, os.environ["aoss_visual_index"], shots, documents)
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(documents)} shots were not indexed")
 
 
 def get_shot_metadata(bucket_shots, jobId, shot_id):
@@ -69,8 +101,10 @@ def get_shot_metadata(bucket_shots, jobId, shot_id):
 
     shot_json = response["Body"].read().decode("utf-8")
 
-    shot_metadata = json.loads(shot_json)
+    return shot_metadata_fields(json.loads(shot_json))
 
+
+def shot_metadata_fields(shot_metadata):
     return (
         shot_metadata["shot_frames"],
         shot_metadata["shot_description"],
@@ -80,35 +114,6 @@ def get_shot_metadata(bucket_shots, jobId, shot_id):
     )
 
 
-def get_text_embedding(text_embedding_model, text):
-    accept = "application/json"
-    content_type = "application/json"
-    if text_embedding_model.startswith("amazon.titan-embed-text"):
-        body = json.dumps({"inputText": text, "dimensions": 1024, "normalize": True})
-        response = bedrock_client.invoke_model(
-            body=body,
-            modelId=text_embedding_model,
-            accept=accept,
-            contentType=content_type,
-        )
-        response_body = json.loads(response["body"].read())
-        embedding = response_body.get("embedding")
-    else:
-        if len(text) > 2048:
-            text = text[:2048]
-        body = json.dumps({"texts": [text], "input_type": "search_document"})
-        response = bedrock_client.invoke_model(
-            body=body,
-            modelId=text_embedding_model,
-            accept=accept,
-            contentType=content_type,
-        )
-        response_body = json.loads(response["body"].read())
-        embedding = response_body.get("embeddings")[0]
-
-    return embedding
-
-
 def get_image_embedding(bucket, jobId, image):
     s3_object = s3_client.get_object(Bucket=bucket, Key=f"{jobId}/{image}.png")
     image_content = s3_object["Body"].read()
@@ -128,20 +133,3 @@ def get_image_embedding(bucket, jobId, image):
     response_body = json.loads(response["body"].read())
     embedding = response_body.get("embedding")
     return embedding
-
-
-def get_opensearch_client(host, region):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
-
-    return client
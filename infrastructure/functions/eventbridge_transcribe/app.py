@@ -4,11 +4,17 @@ from boto3.dynamodb.conditions import Key
 import os
 import json
 import re
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from botocore.config import Config
+from aoss_bulk import bulk_index
+from aws_clients import get_client, get_opensearch_client, get_resource
+from bedrock_embeddings import embed_texts
 
-bedrock_client = boto3.client(service_name="bedrock-runtime")
-dynamodb_client = boto3.resource("dynamodb")
-s3_client = boto3.client("s3")
+# Adaptive retries back off client-side when concurrent embedding calls are throttled
+bedrock_client = get_client(
+    "bedrock-runtime", config=Config(retries={"max_attempts": 10, "mode": "adaptive"})
+)
+dynamodb_client = get_resource("dynamodb")
+s3_client = get_client("s3")
 
 
 def lambda_handler(event, context):
@@ -35,28 +41,33 @@ def lambda_handler(event, context):
 
     client = get_opensearch_client(os.environ["aoss_host"], os.environ["region"])
 
-    for sentence in processed_transcript:
-        aoss_request_body = json.dumps(
-        {
-            "jobId": jobId,
-            "video_name": item["Input"],
-            "transcript_id": f"{sentence["sentence_startTime"] - sentence["sentence_endTime"]}",
-            "transcript_startTime": sentence["sentence_startTime"],
-            "transcript_endTime": sentence["sentence_endTime"],
-            "transcript": sentence["sentence"],
-            "transcript_vector": get_text_embedding(os.environ["text_embedding_model"], sentence["sentence"])
-        }
+    transcript_embeddings = embed_texts(
+        bedrock_client,
+        os.environ["text_embedding_model"],
+        [sentence["sentence"] for sentence in processed_transcript],
+        max_workers=int(os.environ.get("embedding_concurrency", "8")),
     )
-        response = client.index(
-            index=os.environ["aoss_audio_index"],
-            body=aoss_request_body,
-            params={"timeout": 60},
+    documents = []
+    for sentence, transcript_embedding in zip(processed_transcript, transcript_embeddings):
+        documents.append(
+            {
+                "jobId": jobId,
+                "video_name": item["Input"],
+                "transcript_id": str(sentence["sentence_startTime"] - sentence["sentence_endTime"]),
+                "transcript_startTime": sentence["sentence_startTime"],
+                "transcript_endTime": sentence["sentence_endTime"],
+                "transcript": sentence["sentence"],
+                "transcript_vector": transcript_embedding,
+            }
         )
+    failed = bulk_index(client, os.environ["aoss_audio_index"], documents)
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(documents)} transcript sentences were not indexed")
 
     sfTaskToken = item["LambdaTranscribeTaskToken"]
 
     # sendTaskSuccess to Step Function to notify Transcribe has successfully finished the job
-    stepfunctions = boto3.client("stepfunctions")
+    stepfunctions = get_client("stepfunctions")
     sfResponse = stepfunctions.send_task_success(taskToken=sfTaskToken, output="{}")
 
     return {"statusCode": 200}
@@ -130,47 +141,3 @@ def process_transcript(s):
 def time_to_ms(time_str):
     h, m, s, ms = re.split(":|,", time_str)
     return int(h) * 3600000 + int(m) * 60000 + int(s) * 1000 + int(ms)
-
-def get_opensearch_client(host, region):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
-
-    return client
-
-def get_text_embedding(text_embedding_model, text):
-    accept = "application/json"
-    content_type = "application/json"
-    if text_embedding_model.startswith("amazon.titan-embed-text"):
-        body = json.dumps({"inputText": text, "dimensions": 1024, "normalize": True})
-        response = bedrock_client.invoke_model(
-            body=body,
-            modelId=text_embedding_model,
-            accept=accept,
-            contentType=content_type,
-        )
-        response_body = json.loads(response["body"].read())
-        embedding = response_body.get("embedding")
-    else:
-        if len(text) > 2048:
-            text = text[:2048]
-        body = json.dumps({"texts": [text], "input_type": "search_document"})
-        response = bedrock_client.invoke_model(
-            body=body,
-            modelId=text_embedding_model,
-            accept=accept,
-            contentType=content_type,
-        )
-        response_body = json.loads(response["body"].read())
-        embedding = response_body.get("embeddings")[0]
-
-    return embedding
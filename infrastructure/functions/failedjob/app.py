@@ -5,7 +5,9 @@ import boto3
 from botocore.exceptions import ClientError
 import os
 import datetime
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from aws_clients import get_client, get_resource
+from frame_vectors import job_vectors_key
+from shot_batches import detected_shots_manifest_key, shot_manifest_key
 
 
 def lambda_handler(event, context):
@@ -14,12 +16,12 @@ def lambda_handler(event, context):
     status = "Failed"
     endTime = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     updatejobStatus(dynamodb_table, jobId, status, endTime)
-    delete_shot_collection(os.environ["aoss_host"], os.environ["region"], jobId)
+    delete_intermediate_files(os.environ["bucket_shots"], jobId)
     return {"statusCode": 200}
 
 
 def updatejobStatus(dynamodb_table, jobId, status, endTime):
-    dynamodb = boto3.resource("dynamodb")
+    dynamodb = get_resource("dynamodb")
     table = dynamodb.Table(dynamodb_table)
     dynamodbResponse = table.update_item(
         Key={"JobId": jobId},
@@ -29,20 +31,18 @@ def updatejobStatus(dynamodb_table, jobId, status, endTime):
     )
 
 
-def delete_shot_collection(host, region, index):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
-
-    exist = client.indices.exists(index=index)
-    if exist:
-        response = client.indices.delete(index=index)
+def delete_intermediate_files(bucket_shots, jobId):
+    # Only the state machine reads these; the shot records are kept
+    s3_client = get_client("s3")
+    keys = [job_vectors_key(jobId), shot_manifest_key(jobId), detected_shots_manifest_key(jobId)]
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for prefix in ("frame_vectors", "shot_transcripts", "map-results"):
+        for page in paginator.paginate(Bucket=bucket_shots, Prefix=f"{jobId}/{prefix}/"):
+            keys += [item["Key"] for item in page.get("Contents", [])]
+
+    # delete_objects takes at most 1000 keys per request
+    for i in range(0, len(keys), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket_shots,
+            Delete={"Objects": [{"Key": key} for key in keys[i : i + 1000]], "Quiet": True},
+        )
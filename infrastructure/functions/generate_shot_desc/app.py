@@ -6,8 +6,20 @@ from botocore.exceptions import ClientError
 import os
 import time
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+from adaptive_concurrency import AdaptiveConcurrency, watch_client
+from aws_clients import get_client, get_resource
+from bedrock_embeddings import embed_frame
+from frame_vectors import FrameVectors, job_vectors_key
+from bedrock_payloads import (
+    SHOT_DESCRIPTION_MAX_TOKENS,
+    build_converse_message,
+    build_shot_description_prompt,
+)
+from embedding_cache import create_frame_cache
+from shot_batches import map_shots
+from shot_transcripts import TranscriptIndex, shot_transcript_key
 import re
 
 config = Config(read_timeout=900, retries = {
@@ -15,32 +27,57 @@ config = Config(read_timeout=900, retries = {
       'mode': 'standard'
    })
 
-dynamodb_client = boto3.resource("dynamodb")
-bedrock_client = boto3.client(service_name="bedrock-runtime", config=config)
-s3_client = boto3.client("s3")
+dynamodb_client = get_resource("dynamodb")
+bedrock_client = watch_client(get_client("bedrock-runtime", config=config))
+s3_client = get_client("s3")
+frame_cache = create_frame_cache()
+# Shared across containers, so the shots in flight follow Bedrock's throttling
+llm_concurrency = AdaptiveConcurrency(f"bedrock:{os.environ.get('bedrock_llm')}")
+MAX_FRAME_WORKERS = 8
+# Frame vectors of the job this container last worked on
+frame_vectors_cache = {}
 
 
 def lambda_handler(event, context):
+    return map_shots(describe_shot, event)
+
+
+def describe_shot(shot):
+    shot = describe_shot_record(shot)
+    return {
+        "jobId": shot["jobId"],
+        "video_name": shot["video_name"],
+        "shot_id": shot["shot_id"],
+        "shot_startTime": shot["shot_startTime"],
+        "shot_endTime": shot["shot_endTime"],
+    }
+
+
+def describe_shot_record(shot):
+    """Describes the shot, stores its full record in the shots bucket and returns it."""
     bucket_images = os.environ["bucket_images"]
     bucket_shots = os.environ["bucket_shots"]
     bucket_transcripts = os.environ["bucket_transcripts"]
-    jobId = event["jobId"]
-    video_name = event["video_name"]
-    shot_id = event["shot_id"]
-    shot_startTime = event["shot_startTime"]
-    shot_endTime = event["shot_endTime"]
+    jobId = shot["jobId"]
+    video_name = shot["video_name"]
+    shot_id = shot["shot_id"]
+    shot_startTime = shot["shot_startTime"]
+    shot_endTime = shot["shot_endTime"]
 
     shot_frames = get_shot_metadata(bucket_shots, jobId, shot_id)
+    # Frames are fetched once and shared by the embeddings and the description
+    frame_images = get_frame_images(bucket_images, jobId, shot_frames)
 
     shot_frames, shot_publicFigures, shot_privateFigures = (
-        augment_detection_with_embeddings(bucket_images, jobId, shot_frames)
+        augment_detection_with_embeddings(bucket_shots, jobId, shot_frames, frame_images)
     )
 
-    transcript = json.loads(get_subtitle(bucket_transcripts, jobId + ".json"))
-    shot_transcript = add_shot_transcript(shot_startTime, shot_endTime, transcript)
+    shot_transcript = get_shot_transcript(
+        bucket_shots, bucket_transcripts, jobId, shot_id, shot_startTime, shot_endTime
+    )
 
     shot_description = generate_shot_description(
-        bucket_images, jobId, shot_frames, shot_transcript
+        shot_frames, frame_images, shot_transcript
     )
 
     shot = {
@@ -65,13 +102,7 @@ def lambda_handler(event, context):
         ContentType="application/json",
     )
 
-    return {
-        "jobId": jobId,
-        "video_name": video_name,
-        "shot_id": shot_id,
-        "shot_startTime": shot_startTime,
-        "shot_endTime": shot_endTime,
-    }
+    return shot
 
 
 def get_shot_metadata(bucket_shots, jobId, shot_id):
@@ -84,8 +115,39 @@ def get_shot_metadata(bucket_shots, jobId, shot_id):
     return shot_metadata["shot_frames"]
 
 
-def augment_detection_with_embeddings(bucket_images, jobId, shot_frames):
-    client = get_opensearch_client(os.environ["aoss_host"], os.environ["region"], jobId)
+def get_frame_images(bucket_images, jobId, shot_frames):
+    def get_frame_image(frame):
+        s3_object = s3_client.get_object(Bucket=bucket_images, Key=f"{jobId}/{frame['frame']}.png")
+        return s3_object["Body"].read()
+
+    if not shot_frames:
+        return []
+    with ThreadPoolExecutor(max_workers=min(MAX_FRAME_WORKERS, len(shot_frames))) as executor:
+        return list(executor.map(get_frame_image, shot_frames))
+
+
+def get_frame_vectors(bucket_shots, jobId):
+    if jobId not in frame_vectors_cache:
+        response = s3_client.get_object(Bucket=bucket_shots, Key=job_vectors_key(jobId))
+        frame_vectors_cache.clear()
+        frame_vectors_cache[jobId] = FrameVectors.from_bytes(response["Body"].read())
+    return frame_vectors_cache[jobId]
+
+
+def augment_detection_with_embeddings(bucket_shots, jobId, shot_frames, frame_images):
+    embedding_model = os.environ["image_embedding_model"]
+    # Embed all frames in parallel while the job's frame vectors load, then
+    # match every frame against them in one matrix product
+    with ThreadPoolExecutor(max_workers=MAX_FRAME_WORKERS) as executor:
+        frame_vectors_future = executor.submit(get_frame_vectors, bucket_shots, jobId)
+        embeddings = list(
+            executor.map(
+                lambda image: embed_frame(bedrock_client, frame_cache, embedding_model, image),
+                frame_images,
+            )
+        )
+        frame_matches = frame_vectors_future.result().match_many(embeddings)
+
     augmented_shot_frames = []
     shot_publicFigures = set()
     shot_privateFigures = set()
@@ -121,46 +183,24 @@ def augment_detection_with_embeddings(bucket_images, jobId, shot_frames):
             if name and name not in frame_publicFigures:
                 frame_privateFigures.add(name)
 
-        embedding = get_titan_image_embedding(
-            bucket_images,
-            jobId,
-            os.environ["image_embedding_model"],
-            f"{value["frame"]}.png",
-        )
-
-        query = {
-            "size": 100,
-            "query": {"knn": {"frame_image_vector": {"vector": embedding, "k": 100}}},
-            "_source": [
-                "jobId",
-                "video_name",
-                "shot_startTime",
-                "shot_endTime",
-                "frame_publicFigures",
-                "frame_privateFigures",
-            ],
-        }
-        response = client.search(body=query, index=jobId)
-        hits = response["hits"]["hits"]
-        for hit in hits:
-            if hit["_score"] >= 0.8:
-                public_figures = [
-                    name.strip()
-                    for name in hit["_source"]["frame_publicFigures"].split(",")
-                ]
-                for name in public_figures:
-                    if name and name not in shot_publicFigures:
-                        frame_publicFigures.add(name + "*")
-                        shot_publicFigures.add(name + "*")
-
-                private_figures = [
-                    name.strip()
-                    for name in hit["_source"]["frame_privateFigures"].split(",")
-                ]
-                for name in private_figures:
-                    if name and name not in shot_privateFigures and name not in shot_publicFigures:
-                        frame_privateFigures.add(name + "*")
-                        shot_privateFigures.add(name + "*")
+        for match in frame_matches[index]:
+            public_figures = [
+                name.strip()
+                for name in match["frame_publicFigures"].split(",")
+            ]
+            for name in public_figures:
+                if name and name not in shot_publicFigures:
+                    frame_publicFigures.add(name + "*")
+                    shot_publicFigures.add(name + "*")
+
+            private_figures = [
+                name.strip()
+                for name in match["frame_privateFigures"].split(",")
+            ]
+            for name in private_figures:
+                if name and name not in shot_privateFigures and name not in shot_publicFigures:
+                    frame_privateFigures.add(name + "*")
+                    shot_privateFigures.add(name + "*")
 
         frame_publicFigures = from_set_to_str(frame_publicFigures)
         frame_privateFigures = from_set_to_str(frame_privateFigures)
@@ -178,64 +218,19 @@ def augment_detection_with_embeddings(bucket_images, jobId, shot_frames):
     return augmented_shot_frames, shot_publicFigures, shot_privateFigures
 
 
-def generate_shot_description(bucket_images, jobId, shot_frames, shot_transcript):
-    res = []
-
-    prompt = f"""Provide a detailed but concise description of a video shot based on the given frame images. Focus on creating a cohesive narrative of the entire shot rather than describing each frame individually. If the images contain frames from multiple shots, concentrate on describing the most prominent or central shot.
-
-        Before describing the shot:
-
-        - Identify the primary shot among the given frames.
-        - Disregard any frames that appear to belong to previous or next shots.
-        - If uncertain about which frames belong to the current shot, describe only the elements that are consistent across multiple frames.
-        
-        Then, incorporate the following elements in your description: 
-        1. Visual elements:
-        - Describe all visible objects, text, and characters in detail.
-        - For any characters present, include:
-            • Age
-            • Emotional expressions
-            • Clothing and accessories
-            • Physical appearance
-            • Any actions, movements or gestures
-
-        2. Setting and atmosphere:
-        - Provide details about the time, location, and overall ambiance.
-        - Mention any relevant background elements that contribute to the scene.
-
-        3. Incorporate provided information:
-        - Seamlessly integrate details about public figures and private figures if available.
-        - If this information is not provided, rely solely on the visual elements.
-
-        Skip the preamble; go straight into the description."""
-
-    for index, value in enumerate(shot_frames):
-        prompt += f"Frame {index}: Public figures: {value["frame_publicFigures"]}; Private figures: {value["frame_privateFigures"]}\n"
+def generate_shot_description(shot_frames, images, shot_transcript):
+    prompt = build_shot_description_prompt(shot_frames)
 
     # prompt += f"Audio transcription: {shot_transcript}"
 
     model_id = os.environ["bedrock_llm"]
-    message = {
-        "role": "user",
-        "content": [
-            {"text": prompt},
-        ],
-    }
-    for index, value in enumerate(shot_frames):
-        s3_object = s3_client.get_object(
-            Bucket=bucket_images, Key=f"{jobId}/{value["frame"]}.png"
-        )
-        image_content = s3_object["Body"].read()
-        message["content"].append(
-            {"image": {"format": "png", "source": {"bytes": image_content}}}
-        )
-
-    messages = [message]
+    messages = [build_converse_message(prompt, images)]
     inferenceConfig = {
-        "maxTokens": 512,
+        "maxTokens": SHOT_DESCRIPTION_MAX_TOKENS,
     }
 
-    response = bedrock_client.converse(
+    response = llm_concurrency.call(
+        bedrock_client.converse,
         modelId=model_id, messages=messages, inferenceConfig=inferenceConfig
     )
     output_message = response["output"]["message"]
@@ -244,51 +239,16 @@ def generate_shot_description(bucket_images, jobId, shot_frames, shot_transcript
     return output_message
 
 
-def get_titan_image_embedding(bucket_images, jobId, embedding_model, image_name):
-    s3_object = s3_client.get_object(Bucket=bucket_images, Key=jobId + "/" + image_name)
-    image_content = s3_object["Body"].read()
-    base64_image_string = base64.b64encode(image_content).decode()
-
-    accept = "application/json"
-    content_type = "application/json"
-    body = json.dumps({"inputImage": base64_image_string})
-    response = bedrock_client.invoke_model(
-        body=body, modelId=embedding_model, accept=accept, contentType=content_type
-    )
-    response_body = json.loads(response["body"].read())
-    embedding = response_body.get("embedding")
-    return embedding
-
-
-def get_opensearch_client(host, region, index):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
-
-    return client
-
-
-def add_shot_transcript(shot_startTime, shot_endTime, transcript):
-    relevant_transcript = ""
-    for item in transcript:
-        if item["sentence_startTime"] >= shot_endTime:
-            break
-        if item["sentence_endTime"] <= shot_startTime:
-            continue
-        delta_start = max(item["sentence_startTime"], shot_startTime)
-        delta_end = min(item["sentence_endTime"], shot_endTime)
-        if delta_end - delta_start >= 500:
-            relevant_transcript += item["sentence"] + "; "
-    return relevant_transcript
+def get_shot_transcript(bucket_shots, bucket_transcripts, jobId, shot_id, shot_startTime, shot_endTime):
+    try:
+        response = s3_client.get_object(Bucket=bucket_shots, Key=shot_transcript_key(jobId, shot_id))
+        return response["Body"].read().decode("utf-8")
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            raise
+    # Jobs started before the transcripts were assigned per shot
+    transcript = json.loads(get_subtitle(bucket_transcripts, jobId + ".json"))
+    return TranscriptIndex(transcript).shot_transcript(shot_startTime, shot_endTime)
 
 
 def get_subtitle(bucket_transcripts, transcript_filename):
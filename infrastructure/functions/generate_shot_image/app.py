@@ -9,6 +9,7 @@ from PIL import Image
 import math
 import io
 import base64
+from shot_batches import map_shots
 
 dynamodb_client = boto3.resource("dynamodb")
 rek_client = boto3.client("rekognition")
@@ -17,14 +18,18 @@ bedrock_client = boto3.client(service_name="bedrock-runtime")
 
 
 def lambda_handler(event, context):
-    jobId = event["jobId"]
-    video_name = event["video_name"]
+    return map_shots(render_shot, event)
+
+
+def render_shot(shot):
+    jobId = shot["jobId"]
+    video_name = shot["video_name"]
     bucket_images = os.environ["bucket_images"]
     bucket_shots = os.environ["bucket_shots"]
-    shot_startTime = event["shot_startTime"]
-    shot_endTime = event["shot_endTime"]
-    frames = event["frames"]
-    shot_id = f"{shot_startTime}-{shot_endTime}"
+    shot_startTime = shot["shot_startTime"]
+    shot_endTime = shot["shot_endTime"]
+    frames = shot["frames"]
+    shot_id = shot.get("shot_id", f"{shot_startTime}-{shot_endTime}")
 
     images = []
     for frame in frames:
@@ -0,0 +1,60 @@
+import os
+from aws_clients import get_client
+from frame_vectors import decode_frame_vectors, job_vectors_key, merge_frame_vectors
+from shot_batches import detected_shots_manifest_key, encode_shot_manifest, read_shot_manifest
+
+s3_client = get_client("s3")
+
+
+def lambda_handler(event, context):
+    bucket_shots = os.environ["bucket_shots"]
+    jobId = event[0]["jobId"]
+
+    parts = [
+        decode_frame_vectors(
+            s3_client.get_object(Bucket=bucket_shots, Key=key)["Body"].read()
+        )
+        for key in list_shot_vectors(bucket_shots, jobId)
+    ]
+
+    s3_client.put_object(
+        Body=merge_frame_vectors(parts),
+        Bucket=bucket_shots,
+        Key=job_vectors_key(jobId),
+    )
+
+    # The second shot map only reads the shots the first one finished
+    shot_manifest = event[1]["RekognitionShotDetectionParams"]["ShotManifest"]
+    shot_records = set(list_shot_records(bucket_shots, jobId))
+    detected_shots = [
+        shot
+        for shot in read_shot_manifest(s3_client, shot_manifest["Bucket"], shot_manifest["Key"])
+        if f"{jobId}/{shot['shot_id']}.json" in shot_records
+    ]
+    s3_client.put_object(
+        Body=encode_shot_manifest(detected_shots),
+        Bucket=bucket_shots,
+        Key=detected_shots_manifest_key(jobId),
+    )
+
+    return {
+        "jobId": jobId,
+        "frames": sum(len(frames) for frames, _ in parts),
+        "shots": len(detected_shots),
+    }
+
+
+def list_shot_vectors(bucket_shots, jobId):
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_shots, Prefix=f"{jobId}/frame_vectors/"):
+        for item in page.get("Contents", []):
+            yield item["Key"]
+
+
+def list_shot_records(bucket_shots, jobId):
+    # Shot records sit at the top of the job prefix, next to the manifests
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_shots, Prefix=f"{jobId}/", Delimiter="/"):
+        for item in page.get("Contents", []):
+            if item["Key"].endswith(".json"):
+                yield item["Key"]
@@ -5,21 +5,35 @@ import boto3
 from botocore.exceptions import ClientError
 import os
 import time
+from adaptive_concurrency import AdaptiveConcurrency, watch_client
+from aws_clients import get_client, get_resource
+from embedding_cache import create_frame_cache, make_cache_key
+from shot_batches import map_shots
 
-dynamodb_client = boto3.resource("dynamodb")
-rek_client = boto3.client("rekognition")
-s3_client = boto3.client("s3")
+dynamodb_client = get_resource("dynamodb")
+rek_client = watch_client(get_client("rekognition"))
+s3_client = get_client("s3")
+frame_cache = create_frame_cache(codec="json")
+celebrity_concurrency = AdaptiveConcurrency("rekognition:RecognizeCelebrities")
+
+# Rekognition accepts at most 5 MB of inline image bytes
+MAX_INLINE_IMAGE_BYTES = 5 * 1024 * 1024
+CELEBRITY_REQUEST_VERSION = "v1"
 
 
 def lambda_handler(event, context):
+    return map_shots(detect_shot_celebrities, event)
+
+
+def detect_shot_celebrities(shot):
     bucket_images = os.environ["bucket_images"]
     bucket_shots = os.environ["bucket_shots"]
-    jobId = event["jobId"]
-    video_name = event["video_name"]
-    shot_id = event["shot_id"]
-    shot_startTime = event["shot_startTime"]
-    shot_endTime = event["shot_endTime"]
-    shot_frames = event["shot_frames"]
+    jobId = shot["jobId"]
+    video_name = shot["video_name"]
+    shot_id = shot["shot_id"]
+    shot_startTime = shot["shot_startTime"]
+    shot_endTime = shot["shot_endTime"]
+    shot_frames = shot["shot_frames"]
 
     shot_frames = startCelebrityDetection(bucket_images, jobId, shot_frames)
 
@@ -33,20 +47,19 @@ def lambda_handler(event, context):
     }
 
 
-def startCelebrityDetection(bucket_images, jobId, frames):
+def startCelebrityDetection(bucket_images, jobId, frames, frame_images=None):
+    """frame_images optionally holds the frame bytes already read, in frame order."""
     shot_frames = []
-    for frame in frames:
-        response = rek_client.recognize_celebrities(
-            Image={
-                "S3Object": {"Bucket": bucket_images, "Name": f"{jobId}/{frame}.png"}
-            }
+    for index, frame in enumerate(frames):
+        celebrity_faces = get_celebrity_faces(
+            bucket_images, jobId, frame, frame_images[index] if frame_images else None
         )
 
         min_confidence = 98.0
 
         celebrities = set()
 
-        for celebrity in response.get("CelebrityFaces", []):
+        for celebrity in celebrity_faces:
             if celebrity.get("MatchConfidence", 0.0) >= min_confidence:
                 celebrities.add(celebrity["Name"])
 
@@ -55,3 +68,26 @@ def startCelebrityDetection(bucket_images, jobId, frames):
         shot_frames.append({"frame": frame, "frame_publicFigures": celebrities})
 
     return shot_frames
+
+
+def get_celebrity_faces(bucket_images, jobId, frame, image_content=None):
+    def recognize():
+        if image_content is not None and len(image_content) <= MAX_INLINE_IMAGE_BYTES:
+            image = {"Bytes": image_content}
+        else:
+            image = {"S3Object": {"Bucket": bucket_images, "Name": f"{jobId}/{frame}.png"}}
+        response = celebrity_concurrency.call(rek_client.recognize_celebrities, Image=image)
+        # Only what the threshold check needs is kept in the cache
+        return [
+            {"Name": celebrity["Name"], "MatchConfidence": celebrity.get("MatchConfidence", 0.0)}
+            for celebrity in response.get("CelebrityFaces", [])
+        ]
+
+    # Frames read by the caller are cached on their bytes, so repeated frames
+    # skip Rekognition; others are not downloaded just to be hashed
+    if image_content is None:
+        return recognize()
+    return frame_cache.get_or_compute(
+        make_cache_key("rekognition:celebrities", CELEBRITY_REQUEST_VERSION, image_content),
+        recognize,
+    )
@@ -8,11 +8,23 @@ import os
 import time
 import subprocess
 import concurrent.futures
+import queue
+import shutil
+import threading
+from frame_extraction import extract_frames
+from shot_batches import encode_shot_manifest, shot_manifest_key
+from shot_transcripts import shot_id_for
+from video_input import open_video_input
 
 sf_client = boto3.client("stepfunctions")
 rek_client = boto3.client("rekognition")
 s3_client = boto3.client("s3")
 
+SEGMENT_PAGE_SIZE = 1000
+UPLOAD_WORKERS = 10
+# Frames waiting for upload; a full queue holds back extraction so /tmp stays bounded
+UPLOAD_QUEUE_SIZE = 40
+
 
 def lambda_handler(event, context):
     dynamodb_table = os.environ["vss_dynamodb_table"]
@@ -31,20 +43,46 @@ def lambda_handler(event, context):
     jobId = item["JobId"]
     video_name = item["Input"]
 
-    frames, shots = getShotDetectionResults(jobId, video_name, rekognitionTaskId)
-
-    generateImages(
-        jobId,
-        os.environ["bucket_videos"],
-        video_name,
-        frames,
-        os.environ["tmp_dir"],
-        os.environ["bucket_images"],
-    )
+    # Pages of shots are written to the manifest and their frames extracted
+    # while the next page is fetched. The shots go to S3 for the Map states'
+    # ItemReader rather than into the task output, which caps at 256 KB.
+    bucket_shots = os.environ["bucket_shots"]
+    manifest_key = shot_manifest_key(jobId)
+    manifest_path = os.path.join(os.environ["tmp_dir"], f"{jobId}.shots.jsonl")
+    shot_count = 0
+    try:
+        with open(manifest_path, "wb") as manifest:
+            def frame_pages():
+                nonlocal shot_count
+                for shots, is_last_page in prefetch(
+                    iter_shot_pages(jobId, video_name, rekognitionTaskId)
+                ):
+                    manifest.write(encode_shot_manifest(shots))
+                    shot_count += len(shots)
+                    yield [ts for shot in shots for ts in shot["frames"]], is_last_page
+
+            generateImages(
+                jobId,
+                os.environ["bucket_videos"],
+                video_name,
+                frame_pages(),
+                os.environ["tmp_dir"],
+                os.environ["bucket_images"],
+            )
+        s3_client.upload_file(
+            manifest_path,
+            bucket_shots,
+            manifest_key,
+            ExtraArgs={"ContentType": "application/x-ndjson"},
+        )
+    finally:
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
 
     message = event["Records"][0]["Sns"]["Message"]
     message = json.loads(message)
-    message["Shots"] = shots
+    message["ShotManifest"] = {"Bucket": bucket_shots, "Key": manifest_key}
+    message["ShotCount"] = shot_count
     message = json.dumps(message)
 
     sfResponse = sf_client.send_task_success(
@@ -54,16 +92,20 @@ def lambda_handler(event, context):
     return {"statusCode": 200}
 
 
-def getShotDetectionResults(jobId, video_name, rekognitionTaskId):
-    maxResults = 1000
-    paginationToken = ""
+def iter_segments(rekognitionTaskId):
+    """Yields each page of detected segments and whether it is the last page."""
+    request = {"JobId": rekognitionTaskId, "MaxResults": SEGMENT_PAGE_SIZE}
+    while True:
+        response = rek_client.get_segment_detection(**request)
+        next_token = response.get("NextToken")
+        yield response["Segments"], not next_token
+        if not next_token:
+            return
+        request["NextToken"] = next_token
 
-    response = rek_client.get_segment_detection(
-        JobId=rekognitionTaskId, MaxResults=maxResults, NextToken=paginationToken
-    )
 
-    frames = []
-    shots = []
+def iter_shot_pages(jobId, video_name, rekognitionTaskId):
+    """Yields the shots of every segment detection page and whether it is the last page."""
     def get_timestamps(shot, N):
         start_time = shot["StartTimestampMillis"]
         end_time = shot["EndTimestampMillis"]
@@ -71,92 +113,124 @@ def getShotDetectionResults(jobId, video_name, rekognitionTaskId):
         timestamps = [start_time + i * step for i in range(N)]
         return timestamps
 
-    for i, shot in enumerate(response["Segments"]):
-        shot_timestamps = get_timestamps(shot, 3)
-        frames.extend(shot_timestamps)
-
-        shot_startTime = 0 if i == 0 else shot["StartTimestampMillis"]
-        shot_endTime = shot["EndTimestampMillis"]
-
-        shots.append(
-            {
-                "jobId": jobId,
-                "video_name": video_name,
-                "shot_startTime": shot_startTime,
-                "shot_endTime": shot_endTime,
-                "frames": shot_timestamps,
-            }
-        )
+    i = 0
+    for segments, is_last_page in iter_segments(rekognitionTaskId):
+        shots = []
+        for shot in segments:
+            shot_timestamps = get_timestamps(shot, 3)
+
+            shot_startTime = 0 if i == 0 else shot["StartTimestampMillis"]
+            shot_endTime = shot["EndTimestampMillis"]
+
+            shots.append(
+                {
+                    "jobId": jobId,
+                    "video_name": video_name,
+                    "shot_id": shot_id_for(shot_startTime, shot_endTime),
+                    "shot_startTime": shot_startTime,
+                    "shot_endTime": shot_endTime,
+                    "frames": shot_timestamps,
+                }
+            )
+            i += 1
+        yield shots, is_last_page
+
+
+def prefetch(iterable, size=1):
+    """Iterates over iterable on a background thread, up to size items ahead."""
+    items = queue.Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        except Exception as e:
+            items.put((None, e))
+            return
+        items.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+
+class FrameUploader:
+    """Uploads frames from a bounded queue and deletes each local file once uploaded."""
+
+    def __init__(self, bucket_images, jobId):
+        self.bucket_images = bucket_images
+        self.jobId = jobId
+        self.queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+        self.threads = [threading.Thread(target=self.upload) for _ in range(UPLOAD_WORKERS)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, timestamp_ms, frame_path):
+        self.queue.put(frame_path)
+
+    def upload(self):
+        while True:
+            frame_path = self.queue.get()
+            if frame_path is None:
+                return
+            try:
+                s3_client.upload_file(
+                    frame_path,
+                    self.bucket_images,
+                    f"{self.jobId}/{os.path.basename(frame_path)}",
+                    ExtraArgs={"ContentType": "image/png"},
+                )
+            except Exception as e:
+                logging.error(f"Upload of {frame_path} failed: {e}")
+            finally:
+                os.remove(frame_path)
 
-    return frames, shots
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
 
 
-def generateImages(jobId, bucket_videos, video_name, timestamps, tmp_dir, bucket_images):
+def generateImages(jobId, bucket_videos, video_name, frame_pages, tmp_dir, bucket_images):
+    """Extracts and uploads frames for each (timestamps, is_last_page) page."""
     tmp_video_dir = tmp_dir + "/video/"
     tmp_frames_dir = tmp_dir + "/" + jobId + "/"
     os.makedirs(tmp_video_dir, exist_ok=True)
     os.makedirs(tmp_frames_dir, exist_ok=True)
     ffmpeg_path = "/opt/bin/ffmpeg"
     local_video_path = os.path.join(tmp_video_dir, video_name)
-    
-    s3_client.download_file(bucket_videos, video_name, local_video_path)
-    
-    sorted_timestamps = sorted(timestamps)
-    last_timestamp = sorted_timestamps[-1]
-    
-    def extract_frame(timestamp_ms):
-        """Process a single timestamp and extract the frame"""
-        # Handling the last timestamp for edge case.
-        if timestamp_ms == last_timestamp:
-            output_file = f"{tmp_frames_dir}{timestamp_ms}.png"
-            subprocess.run(
-                [
-                    ffmpeg_path,
-                    "-sseof", "-0.1",
-                    "-i", local_video_path,
-                    "-vf", "scale='min(1280,iw):-1'",  #
-                    "-update", "1",
-                    "-frames:v", "1",
-                    "-q:v", "2",
-                    "-y",
-                    output_file
-                ],
-                stderr=subprocess.PIPE
-            )
-        else:
-            timestamp_sec = timestamp_ms / 1000.0
-            output_file = f"{tmp_frames_dir}{timestamp_ms}.png"
-            subprocess.run(
-                [
-                    ffmpeg_path,
-                    "-ss", f"{timestamp_sec:.3f}",
-                    "-i", local_video_path,
-                    "-vf", "scale='min(1280,iw):-1'",
-                    "-vframes", "1", 
-                    "-q:v", "2",
-                    output_file
-                ],
-                stderr=subprocess.PIPE
-            )
-        return output_file
-    
-    # Extract frames in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        frame_futures = [executor.submit(extract_frame, ts) for ts in timestamps]
-        concurrent.futures.wait(frame_futures)
-    
-    extra_args = {"ContentType": "image/png"}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        upload_futures = []
-        for frame_file in os.listdir(tmp_frames_dir):
-            frame_path = os.path.join(tmp_frames_dir, frame_file)
-            upload_futures.append(
-                executor.submit(
-                    s3_client.upload_file,
-                    frame_path,
-                    bucket_images,
-                    f"{jobId}/{frame_file}",
-                    ExtraArgs=extra_args
-                )
+
+    # ffmpeg reads the video straight from S3 unless it has to be downloaded
+    video_input = open_video_input(
+        s3_client,
+        bucket_videos,
+        video_name,
+        local_video_path,
+        os.environ.get("video_input_mode", "url"),
+    )
+
+    # Frames are uploaded while extraction continues
+    uploader = FrameUploader(bucket_images, jobId)
+    try:
+        for timestamps, is_last_page in frame_pages:
+            extract_frames(
+                ffmpeg_path,
+                video_input.ffmpeg_args,
+                timestamps,
+                tmp_frames_dir,
+                os.environ.get("frame_extraction_mode", "single_pass"),
+                on_frame=uploader.put,
+                includes_end=is_last_page,
             )
-        concurrent.futures.wait(upload_futures)
+    finally:
+        uploader.close()
+        # Warm invocations reuse /tmp, so nothing from this job is left behind
+        video_input.close()
+        shutil.rmtree(tmp_frames_dir, ignore_errors=True)
@@ -0,0 +1,288 @@
+"""Frame extraction for the detected shots.
+
+extract_frames_single_pass decodes the video once per pass instead of
+starting one ffmpeg process per timestamp. Each pass covers a contiguous run
+of the sorted timestamps; its select filter keeps the first frame at or after
+each timestamp and the kept frames are written as PNGs to a pipe. showinfo
+reports the time of every kept frame, which maps frames back to timestamps.
+Timestamps a pass cannot satisfy, such as the very end of the video, fall
+back to the per-timestamp extraction.
+
+Both engines call on_frame(timestamp_ms, path) as soon as a frame file is
+written, so callers can upload and delete frames while decoding continues.
+"""
+
+import concurrent.futures
+import logging
+import os
+import queue
+import re
+import struct
+import subprocess
+import threading
+
+SCALE_FILTER = "scale='min(1280,iw):-1'"
+MAX_TIMESTAMPS_PER_PASS = 500
+PER_TIMESTAMP_WORKERS = 10
+# Passes seek to just before their first timestamp and stop just after their last
+PASS_MARGIN_SECONDS = 0.5
+# Tolerance for the rounding of pts_time in the showinfo output
+FRAME_TIME_TOLERANCE_SECONDS = 0.0005
+# Larger than any video timestamp, so "no timestamp left" never selects a frame
+NO_TIMESTAMP = 1e9
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+SHOWINFO_PATTERN = re.compile(r"\bn:\s*\d+\s+pts:\s*\S+\s+pts_time:\s*([-\d.]+)")
+
+
+def input_args(video):
+    """video is a local path or ffmpeg input arguments ending with -i <location>."""
+    return ["-i", video] if isinstance(video, str) else list(video)
+
+
+def frame_path(frames_dir, timestamp_ms):
+    return os.path.join(frames_dir, f"{timestamp_ms}.png")
+
+
+def next_timestamp_expression(seconds, lo, hi):
+    """ffmpeg expression for the first of seconds[lo:hi + 1] after prev_selected_t.
+
+    seconds ends with NO_TIMESTAMP. The binary if() tree keeps the per-frame
+    cost logarithmic in the number of timestamps.
+    """
+    if lo == hi:
+        return f"{seconds[lo]:.3f}"
+    mid = (lo + hi) // 2
+    return (
+        f"if(lt(prev_selected_t,{seconds[mid]:.3f}),"
+        f"{next_timestamp_expression(seconds, lo, mid)},"
+        f"{next_timestamp_expression(seconds, mid + 1, hi)})"
+    )
+
+
+def select_expression(timestamps_ms):
+    seconds = [timestamp_ms / 1000.0 for timestamp_ms in timestamps_ms] + [NO_TIMESTAMP]
+    return (
+        f"if(isnan(prev_selected_t),gte(t,{seconds[0]:.3f}),"
+        f"gte(t,{next_timestamp_expression(seconds, 0, len(seconds) - 1)}))"
+    )
+
+
+def read_png_stream(stream):
+    """Yields the PNG images of a concatenated image2pipe stream."""
+    while True:
+        signature = stream.read(len(PNG_SIGNATURE))
+        if not signature:
+            return
+        if signature != PNG_SIGNATURE:
+            raise ValueError("Unexpected data in the PNG stream")
+        chunks = [signature]
+        while True:
+            header = stream.read(8)
+            if len(header) < 8:
+                raise ValueError("Truncated PNG stream")
+            length, chunk_type = struct.unpack(">I4s", header)
+            chunks.append(header)
+            chunks.append(stream.read(length + 4))  # chunk data and CRC
+            if chunk_type == b"IEND":
+                break
+        yield b"".join(chunks)
+
+
+def read_frame_times(stream, frame_times, log_tail):
+    """Queues the pts_time of every showinfo line; None marks the end of the output."""
+    for line in iter(stream.readline, b""):
+        line = line.decode("utf-8", errors="replace")
+        match = SHOWINFO_PATTERN.search(line)
+        if match:
+            frame_times.put(float(match.group(1)))
+        else:
+            log_tail.append(line.rstrip())
+            del log_tail[:-20]
+    frame_times.put(None)
+
+
+def extract_pass(ffmpeg_path, video, timestamps_ms, frames_dir, on_frame):
+    """Runs one decoding pass; returns the timestamps it wrote frames for."""
+    start = max(0.0, timestamps_ms[0] / 1000.0 - PASS_MARGIN_SECONDS)
+    duration = timestamps_ms[-1] / 1000.0 + PASS_MARGIN_SECONDS - start
+    command = [
+        ffmpeg_path,
+        "-hide_banner",
+        "-nostdin",
+        "-ss", f"{start:.3f}",
+        "-t", f"{duration:.3f}",
+        "-copyts",
+        "-start_at_zero",
+        *input_args(video),
+        "-vf", f"select='{select_expression(timestamps_ms)}',showinfo,{SCALE_FILTER}",
+        "-fps_mode", "passthrough",
+        "-f", "image2pipe",
+        "-vcodec", "png",
+        "-",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # stderr is drained on its own thread so that a full pipe never stalls the decoder
+    frame_times = queue.Queue()
+    log_tail = []
+    reader = threading.Thread(target=read_frame_times, args=(process.stderr, frame_times, log_tail))
+    reader.start()
+
+    extracted = []
+    position = 0
+    try:
+        for image in read_png_stream(process.stdout):
+            frame_time = frame_times.get()
+            if frame_time is None:
+                raise ValueError("more frames than showinfo frame times")
+            # The frame is the first one at or after every timestamp up to its own time
+            while (
+                position < len(timestamps_ms)
+                and timestamps_ms[position] / 1000.0 <= frame_time + FRAME_TIME_TOLERANCE_SECONDS
+            ):
+                path = frame_path(frames_dir, timestamps_ms[position])
+                with open(path, "wb") as f:
+                    f.write(image)
+                extracted.append(timestamps_ms[position])
+                if on_frame:
+                    on_frame(timestamps_ms[position], path)
+                position += 1
+    except ValueError as e:
+        logging.error(f"Frame extraction pass from {timestamps_ms[0]} ms stopped: {e}")
+        process.kill()
+    finally:
+        process.stdout.close()
+        process.wait()
+        reader.join()
+        process.stderr.close()
+
+    if process.returncode != 0:
+        logging.error(
+            f"Frame extraction pass from {timestamps_ms[0]} ms returned {process.returncode}: "
+            + " | ".join(log_tail)
+        )
+    return set(extracted)
+
+
+def extract_frames_single_pass(
+    ffmpeg_path, video, timestamps, frames_dir, max_passes=None, on_frame=None
+):
+    """Extracts frames in a few parallel decoding passes; returns the timestamps left over."""
+    timestamps_ms = sorted(set(timestamps))
+    if not timestamps_ms:
+        return []
+    max_passes = max_passes or os.cpu_count() or 1
+    per_pass = min(MAX_TIMESTAMPS_PER_PASS, -(-len(timestamps_ms) // max_passes))
+    passes = [timestamps_ms[i : i + per_pass] for i in range(0, len(timestamps_ms), per_pass)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_passes) as executor:
+        results = executor.map(
+            lambda pass_timestamps: extract_pass(
+                ffmpeg_path, video, pass_timestamps, frames_dir, on_frame
+            ),
+            passes,
+        )
+        extracted = set().union(*results)
+    return [timestamp_ms for timestamp_ms in timestamps_ms if timestamp_ms not in extracted]
+
+
+def extract_frame(
+    ffmpeg_path, video, timestamp_ms, frames_dir, last_timestamp, on_frame=None
+):
+    """Process a single timestamp and extract the frame"""
+    output_file = frame_path(frames_dir, timestamp_ms)
+    # Handling the last timestamp for edge case.
+    if timestamp_ms == last_timestamp:
+        subprocess.run(
+            [
+                ffmpeg_path,
+                "-sseof", "-0.1",
+                *input_args(video),
+                "-vf", SCALE_FILTER,
+                "-update", "1",
+                "-frames:v", "1",
+                "-q:v", "2",
+                "-y",
+                output_file
+            ],
+            stderr=subprocess.PIPE
+        )
+    else:
+        timestamp_sec = timestamp_ms / 1000.0
+        subprocess.run(
+            [
+                ffmpeg_path,
+                "-ss", f"{timestamp_sec:.3f}",
+                *input_args(video),
+                "-vf", SCALE_FILTER,
+                "-vframes", "1",
+                "-q:v", "2",
+                "-y",
+                output_file
+            ],
+            stderr=subprocess.PIPE
+        )
+    if on_frame and os.path.exists(output_file):
+        on_frame(timestamp_ms, output_file)
+    return output_file
+
+
+def extract_frames_per_timestamp(
+    ffmpeg_path, video, timestamps, frames_dir, last_timestamp=None, on_frame=None
+):
+    """Starts one ffmpeg process per timestamp, as shot detection originally did."""
+    if not timestamps:
+        return
+    last_timestamp = last_timestamp if last_timestamp is not None else max(timestamps)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=PER_TIMESTAMP_WORKERS) as executor:
+        frame_futures = [
+            executor.submit(
+                extract_frame, ffmpeg_path, video, ts, frames_dir, last_timestamp, on_frame
+            )
+            for ts in sorted(set(timestamps))
+        ]
+        concurrent.futures.wait(frame_futures)
+
+
+def extract_frames(
+    ffmpeg_path,
+    video,
+    timestamps,
+    frames_dir,
+    mode="single_pass",
+    on_frame=None,
+    includes_end=True,
+):
+    """Extracts a frame for every timestamp.
+
+    includes_end tells whether the largest timestamp is the end of the video,
+    which is read from the end of the file. It is False for all but the last
+    page of shots.
+    """
+    if not timestamps:
+        return
+    # -1 matches no timestamp, so nothing is read from the end of the file
+    last_timestamp = max(timestamps) if includes_end else -1
+    if mode == "per_timestamp":
+        extract_frames_per_timestamp(
+            ffmpeg_path,
+            video,
+            timestamps,
+            frames_dir,
+            last_timestamp=last_timestamp,
+            on_frame=on_frame,
+        )
+        return
+    remaining = extract_frames_single_pass(
+        ffmpeg_path, video, timestamps, frames_dir, on_frame=on_frame
+    )
+    if remaining:
+        print(f"Extracting {len(remaining)} frames one timestamp at a time")
+        extract_frames_per_timestamp(
+            ffmpeg_path,
+            video,
+            remaining,
+            frames_dir,
+            last_timestamp=last_timestamp,
+            on_frame=on_frame,
+        )
@@ -7,25 +7,35 @@ import os
 import time
 import base64
 from botocore.config import Config
+from adaptive_concurrency import AdaptiveConcurrency, watch_client
+from aws_clients import get_client
+from embedding_cache import create_frame_cache, make_cache_key, prompt_version
+from shot_batches import map_shots
 
 config = Config(read_timeout=900, retries = {
       'max_attempts': 20,
       'mode': 'standard'
    })
 
-bedrock_client = boto3.client(service_name="bedrock-runtime", config=config)
-s3_client = boto3.client("s3")
+bedrock_client = watch_client(get_client("bedrock-runtime", config=config))
+s3_client = get_client("s3")
+frame_cache = create_frame_cache(codec="json")
+llm_concurrency = AdaptiveConcurrency(f"bedrock:{os.environ.get('bedrock_model')}")
 
 
 def lambda_handler(event, context):
+    return map_shots(recognise_shot_figures, event)
+
+
+def recognise_shot_figures(shot):
     bucket_images = os.environ["bucket_images"]
     bucket_shots = os.environ["bucket_shots"]
-    jobId = event["jobId"]
-    video_name = event["video_name"]
-    shot_id = event["shot_id"]
-    shot_startTime = event["shot_startTime"]
-    shot_endTime = event["shot_endTime"]
-    shot_frames = event["shot_frames"]
+    jobId = shot["jobId"]
+    video_name = shot["video_name"]
+    shot_id = shot["shot_id"]
+    shot_startTime = shot["shot_startTime"]
+    shot_endTime = shot["shot_endTime"]
+    shot_frames = shot["shot_frames"]
 
     shot_frames = recognise_person_name(bucket_images, jobId, shot_frames)
 
@@ -39,7 +49,8 @@ def lambda_handler(event, context):
     }
 
 
-def recognise_person_name(bucket_images, jobId, frames):
+def recognise_person_name(bucket_images, jobId, frames, frame_images=None):
+    """frame_images optionally holds the frame bytes already read, in frame order."""
     shot_frames = []
     prompt = f"""Analyze this image and identify person names that are displayed as identification for individuals (such as name plates, interview chyrons, or captions).
 
@@ -66,29 +77,40 @@ def recognise_person_name(bucket_images, jobId, frames):
 
     model_id = os.environ["bedrock_model"]
 
-    for frame in frames:
-        message = {
-            "role": "user",
-            "content": [
-                {"text": prompt},
-            ],
-        }
-        s3_object = s3_client.get_object(
-            Bucket=bucket_images, Key=f"{jobId}/{frame}.png"
-        )
-        image_content = s3_object["Body"].read()
-        message["content"].append(
-            {"image": {"format": "png", "source": {"bytes": image_content}}}
-        )
-        messages = [message]
-        inferenceConfig = {"maxTokens": 128}
-
-        response = bedrock_client.converse(
-            modelId=model_id, messages=messages, inferenceConfig=inferenceConfig
+    for index, frame in enumerate(frames):
+        if frame_images:
+            image_content = frame_images[index]
+        else:
+            s3_object = s3_client.get_object(
+                Bucket=bucket_images, Key=f"{jobId}/{frame}.png"
+            )
+            image_content = s3_object["Body"].read()
+        output_message = frame_cache.get_or_compute(
+            make_cache_key(f"person_name:{model_id}", prompt_version(prompt), image_content),
+            lambda: converse_person_name(model_id, prompt, image_content),
         )
-        output_message = response["output"]["message"]
-        output_message = output_message["content"][0]["text"]
         if "No names recognized" in output_message:
             output_message = ""
         shot_frames.append({"frame": frame, "frame_privateFigures": output_message})
     return shot_frames
+
+
+def converse_person_name(model_id, prompt, image_content):
+    message = {
+        "role": "user",
+        "content": [
+            {"text": prompt},
+        ],
+    }
+    message["content"].append(
+        {"image": {"format": "png", "source": {"bytes": image_content}}}
+    )
+    messages = [message]
+    inferenceConfig = {"maxTokens": 128}
+
+    response = llm_concurrency.call(
+        bedrock_client.converse,
+        modelId=model_id, messages=messages, inferenceConfig=inferenceConfig
+    )
+    output_message = response["output"]["message"]
+    return output_message["content"][0]["text"]
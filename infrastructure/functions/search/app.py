@@ -6,54 +6,139 @@ from botocore.exceptions import ClientError
 import os
 import time
 import subprocess
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 import base64
 import glob
-from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+import threading
+from aws_clients import get_client, get_opensearch_client, get_resource
+from bedrock_embeddings import (
+    IMAGE_EMBEDDING_DIMENSION,
+    TEXT_EMBEDDING_DIMENSION,
+    invoke_image_embedding,
+    invoke_text_embeddings,
+)
+from clip_alignment import rank_clip_alignments
+from embedding_cache import create_cache, make_cache_key, normalize_query_text
+from query_image import normalize_query_image
+from timing import SearchTimer
+from vector_store import DEFAULT_IVF_NPROBE, DEFAULT_SNAPSHOT_CHECK_SECONDS, NumpySearchClient
+from video_input import open_video_input
+
+dynamodb_client = get_resource("dynamodb")
+bedrock_client = get_client("bedrock-runtime")
+s3_client = get_client("s3")
+comprehend_client = get_client("comprehend")
+
+
+def create_embedding_cache():
+    return create_cache(
+        os.environ.get("embedding_cache_table"),
+        int(os.environ.get("embedding_cache_ttl_seconds", "86400")),
+        int(os.environ.get("embedding_cache_max_entries", "1024")),
+    )
+
 
-dynamodb_client = boto3.resource("dynamodb")
-bedrock_client = boto3.client(service_name="bedrock-runtime")
-s3_client = boto3.client("s3")
-comprehend_client = boto3.client("comprehend")
+# Lives for the lifetime of the container so warm invocations reuse embeddings
+embedding_cache = create_embedding_cache()
+search_timer = SearchTimer()
+numpy_search_client = None
+
+
+def get_search_client():
+    # search_backend=numpy serves queries from an in-process snapshot instead
+    # of the AOSS collection; both expose the same search/msearch calls
+    global numpy_search_client
+    if os.environ.get("search_backend", "aoss") != "numpy":
+        return get_opensearch_client(os.environ["aoss_host"], os.environ["region"])
+    if numpy_search_client is None:
+        numpy_search_client = NumpySearchClient(
+            os.environ["vector_snapshot_uri"],
+            local_dir=os.path.join(os.environ.get("tmp_dir", "/tmp"), "vector_snapshots"),
+            nprobe=int(os.environ.get("vector_snapshot_nprobe", DEFAULT_IVF_NPROBE)),
+            check_seconds=float(
+                os.environ.get("vector_snapshot_check_seconds", DEFAULT_SNAPSHOT_CHECK_SECONDS)
+            ),
+        )
+    return numpy_search_client
 
 
 def lambda_handler(event, context):
+    search_timer.reset()
     http_method = event.get("requestContext", {}).get("http", {}).get("method", "GET")
     if http_method == "GET":
         aoss_visual_index = os.environ["aoss_visual_index"]
-        client = get_opensearch_client(
-            os.environ["aoss_host"], os.environ["region"], aoss_visual_index
-        )
+        client = get_search_client()
         query_type = event["queryStringParameters"]["type"]
         user_query = event["queryStringParameters"]["query"]
         if query_type == "text":  # search by text
-            response = searchByText(aoss_visual_index, client, user_query)
+            text_search_mode = os.environ.get("text_search_mode", "knn")
+            if text_search_mode == "exact":
+                response = searchByText(aoss_visual_index, client, user_query)
+            elif text_search_mode == "federated":
+                response = searchByTextFederated(
+                    aoss_visual_index, os.environ["aoss_audio_index"], client, user_query
+                )
+            else:
+                response = searchByTextKnn(aoss_visual_index, client, user_query)
         else:  # search by clip
             response = searchByClip(aoss_visual_index, client, user_query)
     else:  # search by image
         request_data = json.loads(event["body"])
         aoss_visual_index = os.environ["aoss_visual_index"]
-        client = get_opensearch_client(
-            os.environ["aoss_host"], os.environ["region"], aoss_visual_index
-        )
+        client = get_search_client()
         query_type = request_data["type"]
         user_query = request_data["query"]
         if user_query.startswith("data:image"):
             user_query = user_query.split(",")[1]
-        response = searchByImage(aoss_visual_index, client, user_query)
+        with search_timer.span("image_normalization"):
+            user_query, image_key = normalize_query_image(user_query)
+        response = searchByImage(aoss_visual_index, client, user_query, image_key)
 
-    return {"statusCode": 200, "body": json.dumps(response)}
+    search_timer.count("results", len(response))
+    with search_timer.span("serialization"):
+        body = json.dumps(response)
+    print(json.dumps({"embedding_cache": embedding_cache.stats()}))
+    print(search_timer.emf_record(query_type))
+    result = {"statusCode": 200, "body": body}
+    if os.environ.get("server_timing_header", "false").lower() == "true":
+        result["headers"] = {"Server-Timing": search_timer.server_timing()}
+    return result
 
 
 MAX_OPENSEARCH_RESULTS = 100
 OPENSEARCH_RELEVANCE_THRESHOLD = 0.5
 MAX_RERANK_RESULTS = 50
 RERANK_RELEVANCE_THRESHOLD = 0.05
+SHOT_DESC_WEIGHT = 3.0  # 75/25 weight split favouring shot description over transcript
+SHOT_TRANSCRIPT_WEIGHT = 1.0
+
+TEXT_SEARCH_SOURCE_FIELDS = [
+    "jobId",
+    "video_name",
+    "shot_id",
+    "shot_startTime",
+    "shot_endTime",
+    "shot_description",
+    "shot_publicFigures",
+    "shot_privateFigures",
+    "shot_transcript",
+]
 
 
 def searchByText(aoss_visual_index, client, user_query):
     query_embedding = get_text_embedding(os.environ["text_embedding_model"], user_query)
+    hits = get_exact_text_hits(aoss_visual_index, client, query_embedding, user_query)
+    return rank_text_hits(user_query, hits)
+
+
+def searchByTextKnn(aoss_visual_index, client, user_query):
+    query_embedding = get_text_embedding(os.environ["text_embedding_model"], user_query)
+    hits = get_knn_text_hits(aoss_visual_index, client, query_embedding, user_query)
+    return rank_text_hits(user_query, hits)
 
+
+def get_exact_text_hits(aoss_visual_index, client, query_embedding, user_query):
+    # Brute-force scan: every document is scored against both vectors
     aoss_query = {
         "size": MAX_OPENSEARCH_RESULTS,
         "query": {
@@ -71,7 +156,7 @@ def searchByText(aoss_visual_index, client, user_query):
                                     "space_type": "cosinesimil",
                                 },
                             },
-                            "boost": 3.0,  # 75/25 weight split favouring shot description over transcript
+                            "boost": SHOT_DESC_WEIGHT,
                         }
                     },
                     {
@@ -86,51 +171,127 @@ def searchByText(aoss_visual_index, client, user_query):
                                     "space_type": "cosinesimil",
                                 },
                             },
-                            "boost": 1.0,
+                            "boost": SHOT_TRANSCRIPT_WEIGHT,
                         }
                     },
                 ],
                 "minimum_should_match": 1,
             }
         },
-        "_source": [
-            "jobId",
-            "video_name",
-            "shot_id",
-            "shot_startTime",
-            "shot_endTime",
-            "shot_description",
-            "shot_publicFigures",
-            "shot_privateFigures",
-            "shot_transcript",
-        ],
+        "_source": TEXT_SEARCH_SOURCE_FIELDS,
     }
 
+    phrase_filters = get_phrase_filters(user_query)
+    if len(phrase_filters) > 0:
+        aoss_query["query"]["bool"]["must"] = phrase_filters
+
+    with search_timer.span("knn"):
+        response = client.search(body=aoss_query, index=aoss_visual_index)
+    search_timer.count("hits", len(response["hits"]["hits"]))
+    return response["hits"]["hits"]
+
+
+def get_knn_text_hits(aoss_visual_index, client, query_embedding, user_query):
+    # Approximate search: one HNSW query per vector field, sent in a single
+    # _msearch round trip and fused back into the brute-force score scale.
+    phrase_filters = get_phrase_filters(user_query)
+    fields = [
+        ("shot_desc_vector", SHOT_DESC_WEIGHT),
+        ("shot_transcript_vector", SHOT_TRANSCRIPT_WEIGHT),
+    ]
+    msearch_body = []
+    for field, weight in fields:
+        aoss_query = {
+            "size": MAX_OPENSEARCH_RESULTS,
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "knn": {
+                                field: {
+                                    "vector": query_embedding,
+                                    "k": MAX_OPENSEARCH_RESULTS,
+                                }
+                            }
+                        }
+                    ]
+                }
+            },
+            "_source": TEXT_SEARCH_SOURCE_FIELDS,
+        }
+        if len(phrase_filters) > 0:
+            aoss_query["query"]["bool"]["filter"] = phrase_filters
+        msearch_body.append({"index": aoss_visual_index})
+        msearch_body.append(aoss_query)
+
+    with search_timer.span("knn"):
+        response = client.msearch(body=msearch_body)
+    ranked_lists = [
+        (res.get("hits", {}).get("hits", []), weight)
+        for res, (field, weight) in zip(response["responses"], fields)
+    ]
+    fused_hits = fuse_weighted_hits(ranked_lists, MAX_OPENSEARCH_RESULTS)
+    search_timer.count("hits", len(fused_hits))
+    return fused_hits
+
+
+def knn_to_script_score(knn_score):
+    # The HNSW cosinesimil score is 1 / (2 - cos) whereas the knn_score script
+    # returns 1 + cos; map back so fused scores keep the brute-force scale.
+    return 3.0 - 1.0 / knn_score
+
+
+def fuse_weighted_hits(ranked_lists, size):
+    fused = {}
+    floors = []
+    for list_index, (hits, weight) in enumerate(ranked_lists):
+        # A document missing from a list scored at most that list's last hit
+        floors.append(knn_to_script_score(hits[-1]["_score"]) if hits else 0.0)
+        for hit in hits:
+            if hit["_id"] not in fused:
+                fused[hit["_id"]] = {"hit": hit, "scores": {}}
+            fused[hit["_id"]]["scores"][list_index] = knn_to_script_score(
+                hit["_score"]
+            )
+
+    fused_hits = []
+    for entry in fused.values():
+        score = 0.0
+        for list_index, (hits, weight) in enumerate(ranked_lists):
+            score += weight * entry["scores"].get(list_index, floors[list_index])
+        hit = dict(entry["hit"])
+        hit["_score"] = score
+        fused_hits.append(hit)
+    fused_hits.sort(key=lambda x: x["_score"], reverse=True)
+    return fused_hits[:size]
+
+
+def get_phrase_filters(user_query):
     pattern = r'"(.*?)"'
     matches = re.findall(pattern, user_query)
-    if len(matches) > 0:
-        aoss_query["query"]["bool"]["must"] = []
-        for match in matches:
-            aoss_query["query"]["bool"]["must"].append(
-                {
-                    "multi_match": {
-                        "query": match,
-                        "fields": [
-                            "shot_publicFigures",
-                            "shot_privateFigures",
-                            "shot_description",
-                            "shot_transcript",
-                        ],
-                        "type": "phrase",
-                    }
+    phrase_filters = []
+    for match in matches:
+        phrase_filters.append(
+            {
+                "multi_match": {
+                    "query": match,
+                    "fields": [
+                        "shot_publicFigures",
+                        "shot_privateFigures",
+                        "shot_description",
+                        "shot_transcript",
+                    ],
+                    "type": "phrase",
                 }
-            )
+            }
+        )
+    return phrase_filters
 
-    response = client.search(body=aoss_query, index=aoss_visual_index)
-    hits = response["hits"]["hits"]
+
+def rank_text_hits(user_query, hits, threshold=OPENSEARCH_RELEVANCE_THRESHOLD):
     unranked_results = []
     for hit in hits:
-        if hit["_score"] >= OPENSEARCH_RELEVANCE_THRESHOLD:
+        if hit["_score"] >= threshold:
             unranked_results.append(
                 {
                     "jobId": hit["_source"]["jobId"],
@@ -144,7 +305,11 @@ def searchByText(aoss_visual_index, client, user_query):
                     "shot_transcript": hit["_source"]["shot_transcript"],
                 }
             )
-    rerank_results = rerank(user_query, unranked_results, MAX_RERANK_RESULTS)
+    if not unranked_results:
+        return []
+    search_timer.count("rerank_candidates", len(unranked_results))
+    with search_timer.span("rerank"):
+        rerank_results = rerank(user_query, unranked_results, MAX_RERANK_RESULTS)
     ranked_results = []
     for rerank_result in rerank_results:
         if rerank_result["relevanceScore"] >= RERANK_RELEVANCE_THRESHOLD:
@@ -155,6 +320,130 @@ def searchByText(aoss_visual_index, client, user_query):
     return ranked_results
 
 
+MAX_AUDIO_RESULTS = 50
+AUDIO_RELEVANCE_THRESHOLD = 0.6  # knn score 1 / (2 - cos), i.e. cos >= 1/3
+MAX_SHOTS_PER_VIDEO = 1000
+RRF_K = 60
+
+
+def searchByTextFederated(aoss_visual_index, aoss_audio_index, client, user_query):
+    # Visual and audio k-NN run side by side; transcript sentences are then
+    # mapped onto the shots they overlap and both lists are fused with RRF
+    query_embedding = get_text_embedding(os.environ["text_embedding_model"], user_query)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        visual_future = executor.submit(
+            get_knn_text_hits, aoss_visual_index, client, query_embedding, user_query
+        )
+        audio_future = executor.submit(
+            get_audio_hits, aoss_audio_index, client, query_embedding
+        )
+        visual_hits = [
+            hit
+            for hit in visual_future.result()
+            if hit["_score"] >= OPENSEARCH_RELEVANCE_THRESHOLD
+        ]
+        audio_hits = [
+            hit
+            for hit in audio_future.result()
+            if hit["_score"] >= AUDIO_RELEVANCE_THRESHOLD
+        ]
+
+    transcript_shot_hits = map_transcripts_to_shots(
+        aoss_visual_index, client, audio_hits, get_phrase_filters(user_query)
+    )
+    fused_hits = fuse_rrf([visual_hits, transcript_shot_hits], MAX_OPENSEARCH_RESULTS)
+    # Both lists were thresholded on their own score scales before fusion
+    return rank_text_hits(user_query, fused_hits, threshold=0.0)
+
+
+def get_audio_hits(aoss_audio_index, client, query_embedding):
+    aoss_query = {
+        "size": MAX_AUDIO_RESULTS,
+        "query": {
+            "knn": {
+                "transcript_vector": {"vector": query_embedding, "k": MAX_AUDIO_RESULTS}
+            }
+        },
+        "_source": [
+            "jobId",
+            "video_name",
+            "transcript_startTime",
+            "transcript_endTime",
+            "transcript",
+        ],
+    }
+    with search_timer.span("audio_knn"):
+        response = client.search(body=aoss_query, index=aoss_audio_index)
+    search_timer.count("audio_hits", len(response["hits"]["hits"]))
+    return response["hits"]["hits"]
+
+
+def map_transcripts_to_shots(aoss_visual_index, client, audio_hits, phrase_filters):
+    """Turns ranked transcript sentences into a ranked list of shot hits.
+
+    Every shot overlapping a sentence takes the rank of the best sentence
+    that overlaps it. Shots are looked up per video in a single _msearch.
+    """
+    if not audio_hits:
+        return []
+
+    job_ids = list(dict.fromkeys(hit["_source"]["jobId"] for hit in audio_hits))
+    msearch_body = []
+    for job_id in job_ids:
+        aoss_query = {
+            "size": MAX_SHOTS_PER_VIDEO,
+            "query": {
+                "bool": {"filter": [{"match_phrase": {"jobId": job_id}}] + phrase_filters}
+            },
+            "_source": TEXT_SEARCH_SOURCE_FIELDS,
+        }
+        msearch_body.append({"index": aoss_visual_index})
+        msearch_body.append(aoss_query)
+    with search_timer.span("shot_lookup"):
+        response = client.msearch(body=msearch_body)
+
+    shots_by_job = {}
+    for job_id, job_response in zip(job_ids, response["responses"]):
+        if "error" in job_response:
+            logging.error(f"Shot lookup failed for {job_id}: {job_response['error']}")
+            continue
+        shots_by_job[job_id] = job_response["hits"]["hits"]
+
+    shot_hits = {}
+    for rank, audio_hit in enumerate(audio_hits):
+        transcript = audio_hit["_source"]
+        start = float(transcript["transcript_startTime"])
+        end = float(transcript["transcript_endTime"])
+        for shot_hit in shots_by_job.get(transcript["jobId"], []):
+            shot = shot_hit["_source"]
+            if (
+                shot_hit["_id"] not in shot_hits
+                and float(shot["shot_startTime"]) < end
+                and float(shot["shot_endTime"]) > start
+            ):
+                shot_hits[shot_hit["_id"]] = (rank, shot_hit)
+    return [hit for rank, hit in sorted(shot_hits.values(), key=lambda x: x[0])]
+
+
+def fuse_rrf(ranked_lists, size):
+    # Reciprocal rank fusion: only ranks matter, so the visual and audio score
+    # scales never have to be reconciled
+    fused = {}
+    for hits in ranked_lists:
+        for rank, hit in enumerate(hits):
+            if hit["_id"] not in fused:
+                fused[hit["_id"]] = {"hit": hit, "score": 0.0}
+            fused[hit["_id"]]["score"] += 1.0 / (RRF_K + rank + 1)
+
+    fused_hits = []
+    for entry in fused.values():
+        hit = dict(entry["hit"])
+        hit["_score"] = entry["score"]
+        fused_hits.append(hit)
+    fused_hits.sort(key=lambda x: x["_score"], reverse=True)
+    return fused_hits[:size]
+
+
 def rerank(user_query, unranked_results, num_results):
     docs = []
     for unranked_result in unranked_results:
@@ -166,9 +455,7 @@ def rerank(user_query, unranked_results, num_results):
                 "shot_transcript": unranked_result["shot_transcript"],
             }
         )
-    bedrock_agent_runtime = boto3.client(
-        "bedrock-agent-runtime", region_name="us-west-2"
-    )
+    bedrock_agent_runtime = get_client("bedrock-agent-runtime", region_name="us-west-2")
     rerank_model_id = "cohere.rerank-v3-5:0"
     model_package_arn = f"arn:aws:bedrock:us-west-2::foundation-model/{rerank_model_id}"
     sources = []
@@ -201,22 +488,6 @@ def rerank(user_query, unranked_results, num_results):
     return response["results"]
 
 
-def get_opensearch_client(host, region, index):
-    host = host.split("://")[1] if "://" in host else host
-    credentials = boto3.Session().get_credentials()
-    auth = AWSV4SignerAuth(credentials, region, "aoss")
-
-    client = OpenSearch(
-        hosts=[{"host": host, "port": 443}],
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=True,
-        connection_class=RequestsHttpConnection,
-        pool_maxsize=20,
-    )
-
-    return client
-
 # Reserved For future use
 def searchByTextWithAudio(aoss_audio_index, client, user_query):
     text_embedding = get_text_embedding(
@@ -259,12 +530,20 @@ def searchByTextWithAudio(aoss_audio_index, client, user_query):
 
     return response
 
-def searchByImage(aoss_visual_index, client, user_query):
+def searchByImage(aoss_visual_index, client, user_query, image_key=None):
     image_embedding = get_titan_image_embedding(
-        os.environ["image_embedding_model"], user_query
+        os.environ["image_embedding_model"], user_query, image_key
     )
 
-    aoss_query = {
+    aoss_query = build_image_query(image_embedding)
+    with search_timer.span("knn"):
+        response = client.search(body=aoss_query, index=aoss_visual_index)
+    search_timer.count("hits", len(response["hits"]["hits"]))
+    return format_image_hits(response["hits"]["hits"])
+
+
+def build_image_query(image_embedding):
+    return {
         "size": 50,
         "query": {"knn": {"shot_image_vector": {"vector": image_embedding, "k": 50}}},
         "_source": [
@@ -280,8 +559,8 @@ def searchByImage(aoss_visual_index, client, user_query):
         ],
     }
 
-    response = client.search(body=aoss_query, index=aoss_visual_index)
-    hits = response["hits"]["hits"]
+
+def format_image_hits(hits):
     response = []
     for hit in hits:
         if hit["_score"] >= 0:  # Set score threshold
@@ -303,160 +582,232 @@ def searchByImage(aoss_visual_index, client, user_query):
     return response
 
 
+def searchByImages(aoss_visual_index, client, base64_images):
+    # Embeds all images concurrently, then runs every k-NN query in one _msearch
+    if not base64_images:
+        return []
+
+    image_embedding_model = os.environ["image_embedding_model"]
+    max_workers = min(MAX_CLIPSEARCH_EMBEDDING_WORKERS, len(base64_images))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        image_embeddings = list(
+            executor.map(
+                lambda image: get_titan_image_embedding(image_embedding_model, image),
+                base64_images,
+            )
+        )
+
+    return search_image_embeddings(aoss_visual_index, client, image_embeddings)
+
+
+def search_image_embeddings(aoss_visual_index, client, image_embeddings):
+    if not image_embeddings:
+        return []
+
+    msearch_body = []
+    for image_embedding in image_embeddings:
+        msearch_body.append({"index": aoss_visual_index})
+        msearch_body.append(build_image_query(image_embedding))
+    with search_timer.span("knn"):
+        response = client.msearch(body=msearch_body)
+
+    all_image_search_res = []
+    for image_response in response["responses"]:
+        if "error" in image_response:
+            logging.error(f"Clip frame search failed: {image_response['error']}")
+            all_image_search_res.append([])
+        else:
+            all_image_search_res.append(format_image_hits(image_response["hits"]["hits"]))
+            search_timer.count("hits", len(image_response["hits"]["hits"]))
+    return all_image_search_res
+
+
 MAX_CLIPSEARCH_RELEVANCE_THRESHOLD = 0.75
+MAX_CLIPSEARCH_RESULTS = 5
+MAX_CLIPSEARCH_EMBEDDING_WORKERS = 6
+MAX_CLIPSEARCH_FRAMES = 11
+CLIP_STREAM_CHUNK_SIZE = 1024 * 1024
 
 
 def searchByClip(aoss_visual_index, client, user_query):
+    all_frame_search_res = []
+    if os.environ.get("clip_frame_mode", "pipe") == "pipe":
+        all_frame_search_res = search_clip_frames_streaming(
+            aoss_visual_index, client, user_query
+        )
+    if not all_frame_search_res:
+        # Containers that cannot be decoded from a non-seekable stream (e.g. MP4
+        # with the moov atom at the end) yield no frames, so go through /tmp
+        all_frame_search_res = search_clip_frames_from_disk(
+            aoss_visual_index, client, user_query
+        )
+    return rank_clip_alignments(
+        all_frame_search_res, MAX_CLIPSEARCH_RESULTS, MAX_CLIPSEARCH_RELEVANCE_THRESHOLD
+    )
+
+
+def search_clip_frames_streaming(aoss_visual_index, client, user_query):
+    image_embedding_model = os.environ["image_embedding_model"]
+    with ThreadPoolExecutor(max_workers=MAX_CLIPSEARCH_EMBEDDING_WORKERS) as executor:
+        # Frames are submitted as soon as ffmpeg emits them, so embedding the
+        # first frame overlaps with decoding the next one
+        with search_timer.span("frame_extraction"):
+            futures = [
+                executor.submit(
+                    get_titan_image_embedding,
+                    image_embedding_model,
+                    base64.b64encode(frame).decode(),
+                )
+                for frame in stream_clip_frames(
+                    os.environ["bucket_clip_search"], user_query
+                )
+            ]
+        search_timer.count("frames", len(futures))
+        image_embeddings = [future.result() for future in futures]
+
+    return search_image_embeddings(aoss_visual_index, client, image_embeddings)
+
+
+def stream_clip_frames(bucket, key):
+    s3_object = s3_client.get_object(Bucket=bucket, Key=key)
+    process = subprocess.Popen(
+        [
+            "/opt/bin/ffmpeg",
+            "-loglevel",
+            "error",
+            "-i",
+            "pipe:0",
+            "-vf",
+            "fps=1,select='lte(n,10)'",  # 1 FPS, up to 10 frames
+            "-vsync",
+            "0",
+            "-frames:v",
+            str(MAX_CLIPSEARCH_FRAMES),
+            "-q:v",
+            "2",
+            "-f",
+            "image2pipe",
+            "-c:v",
+            "mjpeg",
+            "pipe:1",
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+    def feed_clip():
+        try:
+            for chunk in s3_object["Body"].iter_chunks(CLIP_STREAM_CHUNK_SIZE):
+                process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass  # ffmpeg stops reading once it has enough frames
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed_clip, daemon=True)
+    feeder.start()
+    try:
+        yield from read_jpeg_frames(process.stdout)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        feeder.join()
+        s3_object["Body"].close()
+
+
+def read_jpeg_frames(stream):
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(65536)
+        if not chunk:
+            break
+        buffer += chunk
+        while True:
+            start = buffer.find(b"\xff\xd8")
+            if start == -1:
+                del buffer[:-1]
+                break
+            end = buffer.find(b"\xff\xd9", start + 2)
+            if end == -1:
+                del buffer[:start]
+                break
+            yield bytes(buffer[start : end + 2])
+            del buffer[: end + 2]
+
+
+def search_clip_frames_from_disk(aoss_visual_index, client, user_query):
     tmp_clip_dir = os.environ["tmp_dir"] + "/clip/"
     tmp_frames_dir = os.environ["tmp_dir"] + "/" + user_query + "/"
     os.makedirs(tmp_clip_dir, exist_ok=True)
     os.makedirs(tmp_frames_dir, exist_ok=True)
     ffmpeg_path = "/opt/bin/ffmpeg"
     local_clip_path = os.path.join(tmp_clip_dir, user_query)
-    s3_client.download_file(
-        os.environ["bucket_clip_search"], user_query, local_clip_path
+    clip_input = open_video_input(
+        s3_client,
+        os.environ["bucket_clip_search"],
+        user_query,
+        local_clip_path,
+        os.environ.get("video_input_mode", "url"),
     )
 
     output_pattern = f"{tmp_frames_dir}%03d.png"
     try:
-        subprocess.run(
-            [
-                ffmpeg_path,
-                "-i",
-                local_clip_path,
-                "-vf",
-                "fps=1,select='lte(n,10)'",  # 1 FPS, up to 10 frames
-                "-vsync",
-                "0",
-                "-q:v",
-                "1",
-                output_pattern,
-            ],
-            stderr=subprocess.PIPE,
-        )
-
-        extracted_frames = glob.glob(f"{tmp_frames_dir}*.png")
-        num_frames = len(extracted_frames)
-        all_frame_search_res = []
-        with ThreadPoolExecutor(max_workers=num_frames) as executor:
-            future_to_frame = {}
-            for frame_path in extracted_frames:
-                future = executor.submit(
-                    lambda p: base64.b64encode(open(p, "rb").read()).decode(),
-                    frame_path,
-                )
-                future_to_frame[future] = frame_path
-
-            for future in as_completed(future_to_frame):
-                base64_image = future.result()
-                frame_search_res = searchByImage(aoss_visual_index, client, base64_image)
-                all_frame_search_res.append(frame_search_res)
-
-        # Aggregate results
-        aggregated_results = {}
-        for index, frame_search_res in enumerate(all_frame_search_res):
-            processed_videos = set()
-            for item in frame_search_res:
-                video_name = item["video_name"]
-                if video_name not in processed_videos:
-                    processed_videos.add(video_name)
-
-                    if video_name not in aggregated_results:
-                        aggregated_results[video_name] = {
-                            "scores": [0] * num_frames,
-                            "data": item,
-                        }
-                    # For every frame search, only take into account the highest score of a video in the result
-                    aggregated_results[video_name]["scores"][index] = item["score"]
-                    if (
-                        item["shot_startTime"]
-                        < aggregated_results[video_name]["data"]["shot_startTime"]
-                    ):
-                        aggregated_results[video_name]["data"]["shot_startTime"] = item[
-                            "shot_startTime"
-                        ]
-                    if (
-                        item["shot_endTime"]
-                        > aggregated_results[video_name]["data"]["shot_endTime"]
-                    ):
-                        aggregated_results[video_name]["data"]["shot_endTime"] = item[
-                            "shot_endTime"
-                        ]
-
-        # Calculate score averages and find the best result
-        response = []
-
-        for video_name, result in aggregated_results.items():
-            result["average_score"] = sum(result["scores"]) / num_frames
-
-        if aggregated_results:
-            best_result = max(
-                aggregated_results.values(), key=lambda x: x["average_score"]
-            )
-            best_result["data"]["average_score"] = best_result["average_score"]
-            best_result["data"]["occurrence_count"] = sum(
-                score > 0 for score in best_result["scores"]
+        with search_timer.span("frame_extraction"):
+            subprocess.run(
+                [
+                    ffmpeg_path,
+                    *clip_input.ffmpeg_args,
+                    "-vf",
+                    "fps=1,select='lte(n,10)'",  # 1 FPS, up to 10 frames
+                    "-vsync",
+                    "0",
+                    "-q:v",
+                    "1",
+                    output_pattern,
+                ],
+                stderr=subprocess.PIPE,
             )
-            if (
-                best_result["data"]["average_score"]
-                >= MAX_CLIPSEARCH_RELEVANCE_THRESHOLD
-            ):
-                response.append(
-                    {
-                        "video_name": best_result["data"]["video_name"],
-                        "shot_startTime": best_result["data"]["shot_startTime"],
-                        "shot_endTime": best_result["data"]["shot_endTime"],
-                        "score": best_result["data"]["average_score"],
-                    }
-                )
-        return response
+
+        extracted_frames = sorted(glob.glob(f"{tmp_frames_dir}*.png"))
+        base64_frames = []
+        for frame_path in extracted_frames:
+            with open(frame_path, "rb") as f:
+                base64_frames.append(base64.b64encode(f.read()).decode())
+        return searchByImages(aoss_visual_index, client, base64_frames)
 
     finally:
         # Clean up
         for frame_path in glob.glob(f"{tmp_frames_dir}*.png"):
             os.remove(frame_path)
-        if os.path.exists(local_clip_path):
-            os.remove(local_clip_path)
+        clip_input.close()
 
 
 def get_text_embedding(text_embedding_model, shot_description):
-    accept = "application/json"
-    content_type = "application/json"
-    if text_embedding_model.startswith("amazon.titan-embed-text"):
-        body = json.dumps(
-            {"inputText": shot_description, "dimensions": 1024, "normalize": True}
-        )
-        response = bedrock_client.invoke_model(
-            body=body,
-            modelId=text_embedding_model,
-            accept=accept,
-            contentType=content_type,
-        )
-        response_body = json.loads(response["body"].read())
-        embedding = response_body.get("embedding")
-    else:
-        body = json.dumps(
-            {"texts": [shot_description], "input_type": "search_document"}
-        )
-        response = bedrock_client.invoke_model(
-            body=body,
-            modelId=text_embedding_model,
-            accept=accept,
-            contentType=content_type,
+    shot_description = normalize_query_text(shot_description)
+    key = make_cache_key(
+        text_embedding_model, TEXT_EMBEDDING_DIMENSION, shot_description
+    )
+    with search_timer.span("embedding"):
+        return embedding_cache.get_or_compute(
+            key,
+            lambda: invoke_text_embeddings(
+                bedrock_client, text_embedding_model, [shot_description]
+            )[0],
         )
-        response_body = json.loads(response["body"].read())
-        embedding = response_body.get("embeddings")[0]
 
-    return embedding
 
-
-def get_titan_image_embedding(embedding_model, query):
-    accept = "application/json"
-    content_type = "application/json"
-    body = json.dumps({"inputImage": query})
-    response = bedrock_client.invoke_model(
-        body=body, modelId=embedding_model, accept=accept, contentType=content_type
-    )
-    response_body = json.loads(response["body"].read())
-    embedding = response_body.get("embedding")
-    return embedding
+def get_titan_image_embedding(embedding_model, query, image_key=None):
+    # Near-identical query images, such as re-encoded or resized copies,
+    # usually get the same perceptual key and share one embedding
+    cache_content = f"image:{image_key}" if image_key else query
+    key = make_cache_key(embedding_model, IMAGE_EMBEDDING_DIMENSION, cache_content)
+    with search_timer.span("embedding"):
+        return embedding_cache.get_or_compute(
+            key, lambda: invoke_image_embedding(bedrock_client, embedding_model, query)
+        )
@@ -0,0 +1,126 @@
+import numpy as np
+
+
+def build_score_tensor(all_frame_search_res):
+    """Turns per-frame hit lists into a videos x frames x shots score tensor.
+
+    Shots of each video are ordered by start time so that a left-to-right walk
+    over the shot axis follows the timeline of the source video.
+    """
+    videos = {}
+    for frame_search_res in all_frame_search_res:
+        for item in frame_search_res:
+            shots = videos.setdefault(item["video_name"], {})
+            shots.setdefault(
+                item["shot_id"],
+                (int(item["shot_startTime"]), int(item["shot_endTime"]), item),
+            )
+
+    video_names = list(videos)
+    shot_columns = {}
+    shot_bounds = []
+    shot_items = []
+    max_shots = 0
+    for video_index, video_name in enumerate(video_names):
+        ordered = sorted(videos[video_name].items(), key=lambda x: x[1][0])
+        starts = np.zeros(len(ordered), dtype=np.int64)
+        ends = np.zeros(len(ordered), dtype=np.int64)
+        items = []
+        for column, (shot_id, (start, end, item)) in enumerate(ordered):
+            shot_columns[(video_name, shot_id)] = (video_index, column)
+            starts[column] = start
+            ends[column] = end
+            items.append(item)
+        shot_bounds.append((starts, ends))
+        shot_items.append(items)
+        max_shots = max(max_shots, len(ordered))
+
+    video_idx, frame_idx, shot_idx, scores = [], [], [], []
+    for frame_index, frame_search_res in enumerate(all_frame_search_res):
+        for item in frame_search_res:
+            video_index, column = shot_columns[(item["video_name"], item["shot_id"])]
+            video_idx.append(video_index)
+            frame_idx.append(frame_index)
+            shot_idx.append(column)
+            scores.append(item["score"])
+
+    tensor = np.zeros(
+        (len(video_names), len(all_frame_search_res), max_shots), dtype=np.float32
+    )
+    if scores:
+        np.maximum.at(
+            tensor,
+            (np.array(video_idx), np.array(frame_idx), np.array(shot_idx)),
+            np.array(scores, dtype=np.float32),
+        )
+    return video_names, tensor, shot_bounds, shot_items
+
+
+def align_frames(tensor):
+    """Scores the best monotonic frame-to-shot alignment of every video at once.
+
+    Frame i may map to any shot at or after the shot chosen for frame i - 1,
+    which is the DTW recurrence restricted to forward moves along the video:
+        D[i, j] = S[i, j] + max(D[i - 1, :j + 1])
+    Returns the total alignment score per video and the back-pointers needed
+    to recover the path.
+    """
+    num_videos, num_frames, num_shots = tensor.shape
+    columns = np.arange(num_shots)
+    dp = tensor[:, 0, :].copy()
+    pointers = np.zeros((num_videos, num_frames, num_shots), dtype=np.int32)
+    for frame_index in range(1, num_frames):
+        running_max = np.maximum.accumulate(dp, axis=1)
+        # Index of the latest column holding the running maximum
+        pointers[:, frame_index, :] = np.maximum.accumulate(
+            np.where(dp >= running_max, columns, 0), axis=1
+        )
+        dp = tensor[:, frame_index, :] + running_max
+    return dp, pointers
+
+
+def backtrack(dp_last, pointers, video_index):
+    num_frames = pointers.shape[1]
+    path = np.zeros(num_frames, dtype=np.int64)
+    path[-1] = int(np.argmax(dp_last[video_index]))
+    for frame_index in range(num_frames - 1, 0, -1):
+        path[frame_index - 1] = pointers[video_index, frame_index, path[frame_index]]
+    return path
+
+
+def rank_clip_alignments(all_frame_search_res, top_k, threshold):
+    num_frames = len(all_frame_search_res)
+    if num_frames == 0:
+        return []
+    video_names, tensor, shot_bounds, shot_items = build_score_tensor(
+        all_frame_search_res
+    )
+    if not video_names:
+        return []
+
+    dp_last, pointers = align_frames(tensor)
+    average_scores = dp_last.max(axis=1) / num_frames
+
+    response = []
+    for video_index in np.argsort(-average_scores)[:top_k]:
+        average_score = float(average_scores[video_index])
+        if average_score < threshold:
+            break
+        path = backtrack(dp_last, pointers, video_index)
+        matched = tensor[video_index, np.arange(num_frames), path] > 0
+        if not matched.any():
+            continue
+        matched_shots = path[matched]
+        starts, ends = shot_bounds[video_index]
+        first_item = shot_items[video_index][int(matched_shots.min())]
+        response.append(
+            {
+                "jobId": first_item["jobId"],
+                "video_name": video_names[video_index],
+                "shot_startTime": int(starts[matched_shots].min()),
+                "shot_endTime": int(ends[matched_shots].max()),
+                "score": average_score,
+                "occurrence_count": int(matched.sum()),
+            }
+        )
+    return response
@@ -0,0 +1,66 @@
+import base64
+import io
+import logging
+
+from PIL import Image, ImageOps
+
+# Query images are downscaled to this bounding box before embedding; phone
+# photos are far larger than what the embedding model works with.
+QUERY_IMAGE_MAX_DIMENSION = 512
+QUERY_IMAGE_JPEG_QUALITY = 90
+PERCEPTUAL_HASH_SIZE = 8
+# Colour signature: mean colour of the image at 2 bits per channel
+COLOUR_GRID_SIZE = 1
+COLOUR_LEVEL_SHIFT = 6
+
+
+def normalize_query_image(base64_image):
+    """Downscales and re-encodes a base64 query image.
+
+    Returns the compact base64 JPEG and a cache key for the image, or the
+    original payload and None if the image cannot be decoded. The key is a
+    perceptual hash of the image plus a coarse colour and shape signature, so
+    near-identical images share an embedding while images the grayscale hash
+    cannot tell apart, like flat images of different colours, do not.
+    """
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(base64_image)))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+    except Exception as e:
+        logging.error(f"Query image could not be decoded: {e}")
+        return base64_image, None
+
+    image.thumbnail(
+        (QUERY_IMAGE_MAX_DIMENSION, QUERY_IMAGE_MAX_DIMENSION), Image.LANCZOS
+    )
+    image_key = f"{difference_hash(image)}:{colour_signature(image)}"
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=QUERY_IMAGE_JPEG_QUALITY)
+    normalized_image = base64.b64encode(buffer.getvalue()).decode()
+    # Small, already compact uploads are sent unchanged
+    if len(normalized_image) >= len(base64_image):
+        return base64_image, image_key
+    return normalized_image, image_key
+
+
+def colour_signature(image, grid_size=COLOUR_GRID_SIZE):
+    # Guards the dHash, which ignores colour and maps every flat image to
+    # zero; the aspect ratio keeps crops of a pattern apart
+    cells = image.resize((grid_size, grid_size), Image.BOX).getdata()
+    levels = "".join(str(value >> COLOUR_LEVEL_SHIFT) for cell in cells for value in cell)
+    return f"{levels}:{image.width / image.height:.1f}"
+
+
+def difference_hash(image, hash_size=PERCEPTUAL_HASH_SIZE):
+    # dHash: compare neighbouring brightness of a tiny grayscale thumbnail,
+    # so re-encoded or resized copies usually map to the same value
+    pixels = list(
+        image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata()
+    )
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:0{hash_size * hash_size // 4}x}"
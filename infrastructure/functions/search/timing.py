@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_NAMESPACE = "VideoSemanticSearch"
+
+
+class SearchTimer:
+    """Collects per-stage latency spans and counters for one search request.
+
+    Spans with the same name accumulate, so stages that run once per frame
+    (or concurrently on several threads) report their total time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = {}
+            self.started = time.perf_counter()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.spans[name] = self.spans.get(name, 0.0) + elapsed_ms
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self):
+        with self._lock:
+            spans = dict(self.spans)
+        entries = [f"{name};dur={duration:.1f}" for name, duration in spans.items()]
+        entries.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(entries)
+
+    def emf_record(self, query_type):
+        # CloudWatch Embedded Metric Format: the log line itself becomes metrics
+        # under the QueryType dimension, with no PutMetricData call
+        with self._lock:
+            spans = dict(self.spans)
+            counters = dict(self.counters)
+        spans["total"] = self.total_ms()
+        metrics = [{"Name": f"{name}_ms", "Unit": "Milliseconds"} for name in spans]
+        metrics += [{"Name": name, "Unit": "Count"} for name in counters]
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRIC_NAMESPACE,
+                        "Dimensions": [["QueryType"]],
+                        "Metrics": metrics,
+                    }
+                ],
+            },
+            "QueryType": query_type,
+        }
+        record.update({f"{name}_ms": round(value, 3) for name, value in spans.items()})
+        record.update(counters)
+        return json.dumps(record)
@@ -0,0 +1,372 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+# Rows scored per matrix product; bounds the float32 working set when the
+# snapshot is stored as float16
+SNAPSHOT_BLOCK_ROWS = 65536
+DEFAULT_IVF_NPROBE = 8
+# How long a loaded snapshot is served before its manifest is checked again,
+# so a re-exported snapshot is picked up by warm containers
+DEFAULT_SNAPSHOT_CHECK_SECONDS = 300
+KMEANS_ITERATIONS = 10
+MANIFEST_FILE = "manifest.json"
+METADATA_FILE = "metadata.json"
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def train_ivf(vectors, num_lists, seed=0):
+    """Plain k-means over unit vectors; returns centroids and row assignments."""
+    rng = np.random.default_rng(seed)
+    num_lists = min(num_lists, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for list_index in range(num_lists):
+            members = vectors[assignments == list_index]
+            if len(members):
+                centroids[list_index] = members.mean(axis=0)
+        centroids = normalize_rows(centroids)
+    assignments = np.argmax(vectors @ centroids.T, axis=1)
+    return centroids, assignments
+
+
+def write_snapshot(path, ids, metadata, vectors, dtype="float16", ivf_lists=0, present=None):
+    """Writes a snapshot directory readable by VectorSnapshot.
+
+    metadata maps column name to a list of values, one per id; vectors maps
+    vector field name to a rows x dimension array. present optionally maps a
+    field to a boolean array of the rows that have that vector; the others
+    are never scored for the field.
+    """
+    present = present or {}
+    os.makedirs(path, exist_ok=True)
+    manifest = {
+        "count": len(ids),
+        "dtype": dtype,
+        "fields": {},
+        "files": [MANIFEST_FILE, METADATA_FILE],
+    }
+    for field, matrix in vectors.items():
+        unit_vectors = normalize_rows(matrix)
+        np.save(os.path.join(path, f"{field}.npy"), unit_vectors.astype(dtype))
+        manifest["files"].append(f"{field}.npy")
+        field_manifest = {"dimension": int(unit_vectors.shape[1])}
+        present_rows = np.arange(len(ids), dtype=np.int64)
+        if field in present and not np.all(present[field]):
+            np.save(
+                os.path.join(path, f"{field}.present.npy"),
+                np.asarray(present[field], dtype=bool),
+            )
+            manifest["files"].append(f"{field}.present.npy")
+            field_manifest["present"] = True
+            present_rows = np.flatnonzero(present[field]).astype(np.int64)
+        if ivf_lists and len(present_rows) > ivf_lists:
+            # Only rows with the vector go into the inverted lists
+            centroids, assignments = train_ivf(unit_vectors[present_rows], ivf_lists)
+            # Inverted lists as CSR: rows of list i are rows[offsets[i]:offsets[i + 1]]
+            order = present_rows[np.argsort(assignments, kind="stable")]
+            offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+            np.savez(
+                os.path.join(path, f"{field}.ivf.npz"),
+                centroids=centroids,
+                rows=order,
+                offsets=offsets,
+            )
+            manifest["files"].append(f"{field}.ivf.npz")
+            field_manifest["ivf_lists"] = int(len(centroids))
+        manifest["fields"][field] = field_manifest
+
+    columns = {"_id": list(ids)}
+    columns.update(metadata)
+    with open(os.path.join(path, METADATA_FILE), "w") as f:
+        json.dump(columns, f)
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+
+def download_snapshot(uri, local_path):
+    # Only the S3 path needs AWS; local snapshots work without boto3 credentials
+    from aws_clients import get_client
+
+    s3_client = get_client("s3")
+    bucket, _, prefix = uri[len("s3://") :].partition("/")
+    prefix = prefix.rstrip("/")
+    manifest_body = s3_client.get_object(
+        Bucket=bucket, Key=f"{prefix}/{MANIFEST_FILE}"
+    )["Body"].read()
+
+    local_manifest = os.path.join(local_path, MANIFEST_FILE)
+    if os.path.exists(local_manifest):
+        with open(local_manifest, "rb") as f:
+            if f.read() == manifest_body:
+                return local_path
+
+    os.makedirs(local_path, exist_ok=True)
+    for file_name in json.loads(manifest_body)["files"]:
+        if file_name != MANIFEST_FILE:
+            s3_client.download_file(
+                bucket, f"{prefix}/{file_name}", os.path.join(local_path, file_name)
+            )
+    # Written last so a partial download is never mistaken for a complete one
+    with open(local_manifest, "wb") as f:
+        f.write(manifest_body)
+    return local_path
+
+
+class VectorSnapshot:
+    """Memory-mapped shot vectors plus columnar metadata for one index."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        self.count = self.manifest["count"]
+        self.vectors = {}
+        self.present = {}
+        self.ivf = {}
+        for field, field_manifest in self.manifest["fields"].items():
+            self.vectors[field] = np.load(
+                os.path.join(path, f"{field}.npy"), mmap_mode="r"
+            )
+            if field_manifest.get("present"):
+                self.present[field] = np.load(os.path.join(path, f"{field}.present.npy"))
+            if "ivf_lists" in field_manifest:
+                with np.load(os.path.join(path, f"{field}.ivf.npz")) as ivf:
+                    self.ivf[field] = (ivf["centroids"], ivf["rows"], ivf["offsets"])
+        self._lowercase_columns = {}
+
+    def cosine(self, field, query, rows):
+        """Cosine similarity of a unit query vector with a slice or row index."""
+        block = self.vectors[field][rows]
+        return np.asarray(block, dtype=np.float32) @ query
+
+    def present_rows(self, fields):
+        """Sorted rows that have any of fields, or None when every row does."""
+        if not all(field in self.present for field in fields):
+            return None
+        mask = np.zeros(self.count, dtype=bool)
+        for field in fields:
+            mask |= self.present[field]
+        return np.flatnonzero(mask)
+
+    def presence(self, field, rows):
+        """1.0 for rows that have the vector and 0.0 for the others."""
+        if field not in self.present:
+            return 1.0
+        return self.present[field][rows].astype(np.float32)
+
+    def candidate_rows(self, field, query, nprobe):
+        # IVF probe: only rows in the nprobe closest lists are scored
+        if field not in self.ivf:
+            return None
+        centroids, rows, offsets = self.ivf[field]
+        probed = np.argsort(-(centroids @ query))[:nprobe]
+        return np.sort(
+            np.concatenate([rows[offsets[i] : offsets[i + 1]] for i in probed])
+        )
+
+    def phrase_mask(self, phrase, fields):
+        phrase = phrase.lower()
+        mask = np.zeros(self.count, dtype=bool)
+        for field in fields:
+            if field not in self._lowercase_columns:
+                self._lowercase_columns[field] = [
+                    str(value).lower() for value in self.metadata.get(field, [""] * self.count)
+                ]
+            mask |= np.fromiter(
+                (phrase in value for value in self._lowercase_columns[field]),
+                dtype=bool,
+                count=self.count,
+            )
+        return mask
+
+    def source(self, row, fields):
+        return {field: self.metadata[field][row] for field in fields if field in self.metadata}
+
+    def top_k(self, score_rows, k, rows=None):
+        """Blocked top-k over all rows, or over a sorted array of row indices.
+
+        score_rows takes a slice or an index array and returns their scores.
+        """
+        total = self.count if rows is None else len(rows)
+        best_rows, best_scores = [], []
+        for start in range(0, total, SNAPSHOT_BLOCK_ROWS):
+            stop = min(start + SNAPSHOT_BLOCK_ROWS, total)
+            block_rows = np.arange(start, stop) if rows is None else rows[start:stop]
+            scores = score_rows(slice(start, stop) if rows is None else block_rows)
+            if len(scores) > k:
+                keep = np.argpartition(-scores, k - 1)[:k]
+                block_rows, scores = block_rows[keep], scores[keep]
+            best_rows.append(block_rows)
+            best_scores.append(scores)
+        if not best_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        best_rows = np.concatenate(best_rows)
+        best_scores = np.concatenate(best_scores)
+        order = np.argsort(-best_scores, kind="stable")[:k]
+        return best_rows[order], best_scores[order]
+
+
+def knn_score(cosine):
+    # Same scale as the AOSS nmslib cosinesimil space: 1 / (2 - cos)
+    return 1.0 / (2.0 - cosine)
+
+
+class NumpySearchClient:
+    """In-process stand-in for the OpenSearch client used by the search function.
+
+    Understands the query shapes built in app.py: knn queries, knn_score
+    script_score queries, filter-only queries and multi_match/match_phrase
+    filters, through search and msearch. Snapshots are loaded per index from snapshot_uri/<index>, which
+    is either a local directory or an s3:// prefix.
+    """
+
+    def __init__(
+        self,
+        snapshot_uri,
+        local_dir="/tmp/vector_snapshots",
+        nprobe=DEFAULT_IVF_NPROBE,
+        check_seconds=DEFAULT_SNAPSHOT_CHECK_SECONDS,
+    ):
+        self.snapshot_uri = snapshot_uri.rstrip("/")
+        self.local_dir = local_dir
+        self.nprobe = nprobe
+        self.check_seconds = check_seconds
+        # index -> (snapshot, manifest bytes, time the manifest was checked)
+        self._snapshots = {}
+
+    def snapshot(self, index):
+        now = time.time()
+        cached = self._snapshots.get(index)
+        if cached is not None and now - cached[2] < self.check_seconds:
+            return cached[0]
+
+        uri = f"{self.snapshot_uri}/{index}"
+        path = uri
+        if uri.startswith("s3://"):
+            # Only downloads the files again when the manifest changed
+            path = download_snapshot(uri, os.path.join(self.local_dir, index))
+        with open(os.path.join(path, MANIFEST_FILE), "rb") as f:
+            manifest = f.read()
+        if cached is not None and cached[1] == manifest:
+            snapshot = cached[0]
+        else:
+            snapshot = VectorSnapshot(path)
+        self._snapshots[index] = (snapshot, manifest, now)
+        return snapshot
+
+    def search(self, body, index):
+        snapshot = self.snapshot(index)
+        size = body.get("size", 10)
+        query = body["query"]
+        source_fields = body.get("_source", list(snapshot.metadata))
+
+        if "knn" in query:
+            vector_clauses, filters = query, []
+        else:
+            clauses = query["bool"].get("must", []) + query["bool"].get("should", [])
+            vector_clauses = [c for c in clauses if "knn" in c or "script_score" in c]
+            if len(vector_clauses) == 1 and "knn" in vector_clauses[0]:
+                vector_clauses = vector_clauses[0]
+            filters = [
+                c
+                for c in query["bool"].get("must", []) + query["bool"].get("filter", [])
+                if "multi_match" in c or "match_phrase" in c
+            ]
+
+        mask = None
+        for phrase_filter in filters:
+            if "multi_match" in phrase_filter:
+                phrase = phrase_filter["multi_match"]["query"]
+                fields = phrase_filter["multi_match"]["fields"]
+            else:
+                (field, phrase), = phrase_filter["match_phrase"].items()
+                fields = [field]
+            phrase_mask = snapshot.phrase_mask(phrase, fields)
+            mask = phrase_mask if mask is None else mask & phrase_mask
+        filtered_rows = None if mask is None else np.flatnonzero(mask)
+
+        if not vector_clauses:
+            # Filter-only lookup; every matching row scores 1 like a filter clause
+            rows = np.arange(snapshot.count) if filtered_rows is None else filtered_rows
+            scores = np.ones(len(rows), dtype=np.float32)
+        elif isinstance(vector_clauses, dict):
+            rows, scores = self._knn(snapshot, vector_clauses["knn"], filtered_rows)
+        else:
+            rows, scores = self._script_score(snapshot, vector_clauses, size, filtered_rows)
+
+        hits = [
+            {
+                "_id": snapshot.metadata["_id"][row],
+                "_score": float(score),
+                "_source": snapshot.source(row, source_fields),
+            }
+            for row, score in zip(rows[:size].tolist(), scores[:size].tolist())
+        ]
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+    def msearch(self, body):
+        responses = []
+        for header, query in zip(body[0::2], body[1::2]):
+            try:
+                responses.append(self.search(query, header["index"]))
+            except Exception as e:
+                logging.error(f"Snapshot search failed: {e}")
+                responses.append({"error": str(e)})
+        return {"responses": responses}
+
+    def _knn(self, snapshot, knn_clause, filtered_rows):
+        (field, params), = knn_clause.items()
+        query = normalize_rows(params["vector"])
+        # IVF lists only hold rows with the vector; otherwise rows without it
+        # are left out here, like documents without the field in AOSS
+        rows = snapshot.candidate_rows(field, query, self.nprobe)
+        if rows is None:
+            rows = snapshot.present_rows([field])
+        if filtered_rows is not None:
+            rows = filtered_rows if rows is None else np.intersect1d(rows, filtered_rows)
+        rows, cosines = snapshot.top_k(
+            lambda r: snapshot.cosine(field, query, r), params["k"], rows
+        )
+        return rows, knn_score(cosines)
+
+    def _script_score(self, snapshot, clauses, size, filtered_rows):
+        # Exact scoring over every row, weighted per field like the knn_score script
+        weighted_fields = []
+        for clause in clauses:
+            script_score = clause["script_score"]
+            params = script_score["script"]["params"]
+            weighted_fields.append(
+                (
+                    params["field"],
+                    normalize_rows(params["query_value"]),
+                    script_score.get("boost", 1.0),
+                )
+            )
+
+        def score_rows(rows):
+            # A field the row has no vector for adds nothing to its score
+            total = 0.0
+            for field, query, boost in weighted_fields:
+                total = total + boost * snapshot.presence(field, rows) * (
+                    1.0 + snapshot.cosine(field, query, rows)
+                )
+            return total
+
+        # Rows without any of the fields match none of the should clauses
+        rows = snapshot.present_rows([field for field, _, _ in weighted_fields])
+        if filtered_rows is not None:
+            rows = filtered_rows if rows is None else np.intersect1d(rows, filtered_rows)
+        return snapshot.top_k(score_rows, size, rows)
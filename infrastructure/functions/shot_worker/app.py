@@ -0,0 +1,105 @@
+"""Fused per-shot worker.
+
+Runs the per-shot states of either shot map in a single invocation, reusing
+the functions of the individual Lambdas. The "detect" stage covers Generate
+Shot Image, the celebrity and other-figure detections and Create Shot Image
+Collection, reading every frame from S3 once. The "describe" stage covers
+Generate Shot Desc and the embedding and ingestion to OpenSearch. The
+outputs in S3 and OpenSearch are the same as with the separate states.
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from aws_clients import get_client
+from shot_batches import map_shots, raise_failures, run_shot_batch, shot_items
+from create_shot_collection import app as shot_collection
+from embedding_aoss import app as embedding
+from generate_shot_desc import app as shot_desc
+from generate_shot_image import app as shot_image
+from rekognition_celebrity_detection import app as celebrity_detection
+from rekognize_other_figures import app as other_figures
+
+s3_client = get_client("s3")
+
+DETECTION_WORKERS = 3
+
+
+def lambda_handler(event, context):
+    stage = event.get("BatchInput", {}).get("ShotStage", "detect")
+    if stage == "describe":
+        return describe_shots(event)
+    return map_shots(detect_shot, event)
+
+
+def get_frame_images(bucket_images, jobId, frames):
+    def get_frame_image(frame):
+        s3_object = s3_client.get_object(Bucket=bucket_images, Key=f"{jobId}/{frame}.png")
+        return s3_object["Body"].read()
+
+    with ThreadPoolExecutor(max_workers=max(1, len(frames))) as executor:
+        return list(executor.map(get_frame_image, frames))
+
+
+def detect_shot(shot):
+    bucket_images = os.environ["bucket_images"]
+    bucket_shots = os.environ["bucket_shots"]
+    jobId = shot["jobId"]
+    frames = shot["frames"]
+    shot_id = shot.get("shot_id", f"{shot['shot_startTime']}-{shot['shot_endTime']}")
+    shot = dict(shot, shot_id=shot_id)
+
+    frame_images = get_frame_images(bucket_images, jobId, frames)
+
+    # The shot image and both detections only depend on the frames
+    with ThreadPoolExecutor(max_workers=DETECTION_WORKERS) as executor:
+        shot_image_future = executor.submit(
+            shot_image.generate_shot_image,
+            jobId,
+            bucket_shots,
+            [Image.open(io.BytesIO(image)) for image in frame_images],
+            shot_id,
+        )
+        celebrities_future = executor.submit(
+            celebrity_detection.startCelebrityDetection,
+            bucket_images,
+            jobId,
+            frames,
+            frame_images,
+        )
+        other_figures_future = executor.submit(
+            other_figures.recognise_person_name,
+            bucket_images,
+            jobId,
+            frames,
+            frame_images,
+        )
+        shot_image_future.result()
+        celebrities = celebrities_future.result()
+        private_figures = other_figures_future.result()
+
+    shot_frames = [
+        {
+            "frame": celebrity["frame"],
+            "frame_publicFigures": celebrity["frame_publicFigures"],
+            "frame_privateFigures": private_figure["frame_privateFigures"],
+        }
+        for celebrity, private_figure in zip(celebrities, private_figures)
+    ]
+
+    return shot_collection.save_shot_collection(shot, shot_frames, frame_images)
+
+
+def describe_shots(event):
+    shots, _ = shot_items(event)
+    records, failures = run_shot_batch(shot_desc.describe_shot_record, shots)
+    described = [(shot, record) for shot, record in zip(shots, records) if record is not None]
+    # The records are indexed as returned instead of being read back from S3
+    if described:
+        embedding.index_shots(
+            [shot for shot, _ in described],
+            [embedding.shot_metadata_fields(record) for _, record in described],
+        )
+    raise_failures(failures, len(shots))
+    return {"status": 200}
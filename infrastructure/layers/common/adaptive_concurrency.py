@@ -0,0 +1,253 @@
+"""AIMD concurrency limits shared by every Lambda container.
+
+Each limit is one item of the rate control table, keyed by a scope such as
+"bedrock:<model id>" or "rekognition". A call takes a lease in the item while
+fewer leases than the limit are live and returns it when done. A throttled
+call halves the limit, at most once per cooldown. A successful call grows it
+by one over the current limit, so it climbs by about one per full round of
+calls. A call slower than the latency target leaves it where it is. Leases
+expire, so a container that dies mid-call does not keep its slot.
+
+Throttles are seen on every attempt, including the ones botocore retries on
+its own, through a needs-retry hook on the clients passed to watch_client.
+When the rate control table cannot be reached, calls run without a lease
+and the error is logged, so the table never fails a model call.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from aws_clients import get_resource
+
+DEFAULT_INITIAL_LIMIT = 10
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 100
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_LATENCY_TARGET_SECONDS = 30
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN_SECONDS = 5
+# Waiting for a slot gives up after this long and runs the call anyway, so a
+# stuck table never stalls a job
+MAX_WAIT_SECONDS = 120
+MAX_POLL_SECONDS = 2.0
+
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "ServiceQuotaExceededException",
+    "LimitExceededException",
+}
+
+_calls = threading.local()
+_watched_clients = set()
+_watch_lock = threading.Lock()
+
+
+def is_throttle(error):
+    return (
+        isinstance(error, ClientError)
+        and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    )
+
+
+def record_attempt(response=None, **kwargs):
+    """needs-retry hook; counts throttled attempts of the call on this thread."""
+    if response is None or getattr(_calls, "throttles", None) is None:
+        return None
+    error_code = response[1].get("Error", {}).get("Code")
+    if error_code in THROTTLING_ERROR_CODES:
+        _calls.throttles += 1
+    # Returning None leaves the retry decision to botocore
+    return None
+
+
+def watch_client(client):
+    """Reports the throttled attempts of client to the controller making the call."""
+    with _watch_lock:
+        if id(client) in _watched_clients:
+            return client
+        _watched_clients.add(id(client))
+    client.meta.events.register_first("needs-retry", record_attempt)
+    return client
+
+
+def env_number(name, default):
+    return float(os.environ.get(name, default))
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the calls in flight for one scope.
+
+    Without a table the calls run unlimited, as before.
+    """
+
+    def __init__(self, scope, table_name=None):
+        table_name = table_name or os.environ.get("rate_control_table")
+        self.table = get_resource("dynamodb").Table(table_name) if table_name else None
+        self.key = {"ControlKey": f"concurrency:{scope}"}
+        self.initial_limit = env_number("concurrency_initial_limit", DEFAULT_INITIAL_LIMIT)
+        self.min_limit = env_number("concurrency_min_limit", DEFAULT_MIN_LIMIT)
+        self.max_limit = env_number("concurrency_max_limit", DEFAULT_MAX_LIMIT)
+        self.lease_seconds = env_number("concurrency_lease_seconds", DEFAULT_LEASE_SECONDS)
+        self.latency_target = env_number(
+            "concurrency_latency_target_seconds", DEFAULT_LATENCY_TARGET_SECONDS
+        )
+        self.limit = self.initial_limit
+        self._initialized = False
+
+    def _ensure_item(self):
+        if self._initialized:
+            return
+        try:
+            self.table.put_item(
+                Item={
+                    **self.key,
+                    "ConcurrencyLimit": int(self.initial_limit),
+                    "Leases": {},
+                    "LastDecrease": 0,
+                },
+                ConditionExpression="attribute_not_exists(ControlKey)",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        self._initialized = True
+
+    def _remove_expired_leases(self, now):
+        item = self.table.get_item(Key=self.key, ConsistentRead=True).get("Item", {})
+        self.limit = float(item.get("ConcurrencyLimit", self.limit))
+        expired = [
+            lease for lease, expires_at in item.get("Leases", {}).items()
+            if expires_at < now
+        ]
+        if expired:
+            names = {f"#l{i}": lease for i, lease in enumerate(expired)}
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression="REMOVE " + ", ".join(f"Leases.{name}" for name in names),
+                ExpressionAttributeNames=names,
+            )
+
+    def acquire(self):
+        """Waits for a slot; returns its lease id, or None when running without one."""
+        if self.table is None:
+            return None
+        lease = uuid.uuid4().hex
+        deadline = time.time() + MAX_WAIT_SECONDS
+        try:
+            self._ensure_item()
+            while True:
+                now = time.time()
+                try:
+                    response = self.table.update_item(
+                        Key=self.key,
+                        UpdateExpression="SET Leases.#lease = :expires",
+                        ConditionExpression="size(Leases) < ConcurrencyLimit",
+                        ExpressionAttributeNames={"#lease": lease},
+                        ExpressionAttributeValues={":expires": int(now + self.lease_seconds)},
+                        ReturnValues="UPDATED_NEW",
+                    )
+                    self.limit = float(
+                        response["Attributes"].get("ConcurrencyLimit", self.limit)
+                    )
+                    return lease
+                except ClientError as e:
+                    if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+                if now > deadline:
+                    logging.warning(f"No slot for {self.key['ControlKey']}; running without one")
+                    return None
+                self._remove_expired_leases(now)
+                time.sleep(random.uniform(0.1, MAX_POLL_SECONDS))
+        except (BotoCoreError, ClientError) as e:
+            logging.error(f"Concurrency control failed for {self.key['ControlKey']}: {e}")
+            return None
+
+    def release(self, lease, outcome="ok", latency=0.0):
+        """Returns the lease; outcome is "ok", "throttled" or "failed"."""
+        if lease is None:
+            return
+        remove = "REMOVE Leases.#lease"
+        names = {"#lease": lease}
+        try:
+            if outcome == "throttled":
+                now = time.time()
+                decreased = int(max(self.min_limit, self.limit * DECREASE_FACTOR))
+                self._update_with_fallback(
+                    remove + " SET ConcurrencyLimit = :limit, LastDecrease = :now",
+                    "LastDecrease < :cooldown AND ConcurrencyLimit > :limit",
+                    names,
+                    {
+                        ":limit": decreased,
+                        ":now": int(now),
+                        ":cooldown": int(now - DECREASE_COOLDOWN_SECONDS),
+                    },
+                )
+            elif (
+                outcome == "ok"
+                and latency <= self.latency_target
+                and self.limit < self.max_limit
+            ):
+                self._update_with_fallback(
+                    remove + " ADD ConcurrencyLimit :step",
+                    "ConcurrencyLimit < :max",
+                    names,
+                    {
+                        # DynamoDB numbers go through boto3 as Decimal
+                        ":step": Decimal(str(round(1.0 / max(self.limit, 1.0), 4))),
+                        ":max": int(self.max_limit),
+                    },
+                )
+            else:
+                self.table.update_item(
+                    Key=self.key, UpdateExpression=remove, ExpressionAttributeNames=names
+                )
+        except (BotoCoreError, ClientError) as e:
+            logging.error(f"Concurrency release failed for {self.key['ControlKey']}: {e}")
+
+    def _update_with_fallback(self, update, condition, names, values):
+        """Applies update when condition holds and otherwise only returns the lease."""
+        try:
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression=update,
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression="REMOVE Leases.#lease",
+                ExpressionAttributeNames=names,
+            )
+
+    def call(self, fn, *args, **kwargs):
+        """Runs fn in a slot and adjusts the limit from its throttles and latency."""
+        lease = self.acquire()
+        _calls.throttles = 0
+        start = time.time()
+        outcome = "failed"
+        try:
+            result = fn(*args, **kwargs)
+            outcome = "ok"
+            return result
+        except Exception as e:
+            if is_throttle(e):
+                outcome = "throttled"
+            raise
+        finally:
+            if _calls.throttles:
+                outcome = "throttled"
+            _calls.throttles = None
+            self.release(lease, outcome, time.time() - start)
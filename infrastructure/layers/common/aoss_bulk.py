@@ -0,0 +1,100 @@
+"""Size-capped, retrying _bulk writes to OpenSearch Serverless.
+
+Vector search collections assign document IDs themselves and reject index
+actions with an _id, so documents are always indexed without one. Writes
+that may be retried delete what an earlier attempt indexed first, by the
+IDs a search returns, with bulk_delete.
+"""
+
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_BULK_BYTES = 5 * 1024 * 1024
+MAX_BULK_ACTIONS = 500
+MAX_BULK_RETRIES = 4
+BULK_BACKOFF_SECONDS = 0.5
+BULK_REQUEST_TIMEOUT = 60
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def encode_bulk_action(index, document):
+    return json.dumps({"index": {"_index": index}}) + "\n" + json.dumps(document) + "\n"
+
+
+def encode_delete_action(index, document_id):
+    return json.dumps({"delete": {"_index": index, "_id": document_id}}) + "\n"
+
+
+def chunk_actions(positions, encoded, max_bytes=MAX_BULK_BYTES, max_actions=MAX_BULK_ACTIONS):
+    chunk, chunk_bytes = [], 0
+    for position in positions:
+        size = len(encoded[position].encode("utf-8"))
+        if chunk and (chunk_bytes + size > max_bytes or len(chunk) >= max_actions):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(position)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+def send_chunk(client, encoded, chunk):
+    """Sends one _bulk request; returns (retryable, failed) item positions."""
+    try:
+        response = client.bulk(
+            body="".join(encoded[position] for position in chunk),
+            request_timeout=BULK_REQUEST_TIMEOUT,
+        )
+    except Exception as e:
+        # Throttled or dropped request: the whole chunk is tried again
+        logging.error(f"Bulk request of {len(chunk)} documents failed: {e}")
+        return chunk, []
+
+    if not response.get("errors"):
+        return [], []
+    retryable, failed = [], []
+    for position, item in zip(chunk, response["items"]):
+        (action, result), = item.items()
+        # A document that is already gone needs no deleting
+        if result.get("status", 200) < 300 or (action == "delete" and result["status"] == 404):
+            continue
+        if result["status"] in RETRYABLE_STATUSES:
+            retryable.append(position)
+        else:
+            logging.error(f"Bulk item {position} rejected: {result.get('error')}")
+            failed.append(position)
+    return retryable, failed
+
+
+def bulk_index(client, index, documents, max_workers=2, max_retries=MAX_BULK_RETRIES):
+    """Indexes documents with _bulk and retries only the items that failed.
+
+    Returns the positions of documents that could not be indexed.
+    """
+    encoded = [encode_bulk_action(index, document) for document in documents]
+    return send_bulk(client, encoded, max_workers, max_retries)
+
+
+def bulk_delete(client, index, document_ids, max_workers=2, max_retries=MAX_BULK_RETRIES):
+    """Deletes documents by ID; returns the positions of IDs that could not be deleted."""
+    encoded = [encode_delete_action(index, document_id) for document_id in document_ids]
+    return send_bulk(client, encoded, max_workers, max_retries)
+
+
+def send_bulk(client, encoded, max_workers=2, max_retries=MAX_BULK_RETRIES):
+    pending = list(range(len(encoded)))
+    failed = []
+    for attempt in range(max_retries + 1):
+        if not pending:
+            break
+        if attempt > 0:
+            time.sleep(BULK_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.0))
+        chunks = list(chunk_actions(pending, encoded))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+            results = list(executor.map(lambda chunk: send_chunk(client, encoded, chunk), chunks))
+        pending = sorted(position for retryable, _ in results for position in retryable)
+        failed += [position for _, rejected in results for position in rejected]
+    return sorted(failed + pending)
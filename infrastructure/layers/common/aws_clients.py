@@ -0,0 +1,125 @@
+"""Container-scoped AWS and OpenSearch clients shared by the Lambda functions.
+
+Clients are created on first use and kept for the lifetime of the Lambda
+container, so warm invocations reuse pooled keep-alive connections instead of
+paying TLS handshakes and credential resolution on every request.
+"""
+
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+DEFAULT_POOL_MAXSIZE = 20
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_opensearch_clients = {}
+
+
+def get_pool_maxsize():
+    return int(os.environ.get("aws_client_pool_maxsize", DEFAULT_POOL_MAXSIZE))
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.Session()
+        return _session
+
+
+def config_key(config):
+    """A hashable key for the options of a botocore Config."""
+    if config is None:
+        return None
+    return repr(sorted(vars(config).items()))
+
+
+def get_client(service_name, region_name=None, config=None):
+    """Returns a cached boto3 client.
+
+    Clients are cached per service, region and config, so modules sharing a
+    container each get the timeouts and retries they ask for.
+    """
+    key = (service_name, region_name, config_key(config))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    client_config = Config(tcp_keepalive=True, max_pool_connections=get_pool_maxsize())
+    if config is not None:
+        client_config = client_config.merge(config)
+    session = get_session()
+    created = False
+    with _lock:
+        if key not in _clients:
+            _clients[key] = session.client(
+                service_name, region_name=region_name, config=client_config
+            )
+            created = True
+        client = _clients[key]
+    # Outside the lock, since the limiter gets its DynamoDB table from here
+    if created:
+        install_rate_limiter(client)
+    return client
+
+
+def install_rate_limiter(client):
+    """Makes calls of rate-limited APIs wait for a token from the shared buckets."""
+    if not os.environ.get("rate_limits"):
+        return
+    from rate_limiter import get_rate_limiter
+
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        limiter.install(client)
+
+
+def get_resource(service_name, region_name=None):
+    key = ("resource", service_name, region_name)
+    resource = _clients.get(key)
+    if resource is not None:
+        return resource
+
+    session = get_session()
+    with _lock:
+        if key not in _clients:
+            _clients[key] = session.resource(
+                service_name,
+                region_name=region_name,
+                config=Config(tcp_keepalive=True, max_pool_connections=get_pool_maxsize()),
+            )
+        return _clients[key]
+
+
+def get_opensearch_client(host, region):
+    host = host.split("://")[1] if "://" in host else host
+    key = (host, region)
+    client = _opensearch_clients.get(key)
+    if client is not None:
+        return client
+
+    # opensearch-py comes from the opensearch layer; functions that only need
+    # boto3 clients do not have to attach it
+    from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
+
+    # The signer asks the session credentials for a frozen copy on every
+    # request, which refreshes them lazily when they are about to expire
+    credentials = get_session().get_credentials()
+    auth = AWSV4SignerAuth(credentials, region, "aoss")
+    with _lock:
+        if key not in _opensearch_clients:
+            _opensearch_clients[key] = OpenSearch(
+                hosts=[{"host": host, "port": 443}],
+                http_auth=auth,
+                use_ssl=True,
+                verify_certs=True,
+                connection_class=RequestsHttpConnection,
+                pool_maxsize=int(
+                    os.environ.get("aoss_pool_maxsize", DEFAULT_POOL_MAXSIZE)
+                ),
+            )
+        return _opensearch_clients[key]
@@ -0,0 +1,84 @@
+"""Bedrock embedding payloads and batched text embedding."""
+
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding_cache import make_cache_key
+
+TEXT_EMBEDDING_DIMENSION = 1024
+IMAGE_EMBEDDING_DIMENSION = 1024  # Titan Multimodal Embeddings default output length
+COHERE_MAX_TEXTS = 96  # Cohere Embed accepts up to 96 texts per request
+COHERE_MAX_CHARACTERS = 2048
+DEFAULT_EMBEDDING_WORKERS = 8
+
+
+def is_titan_text_model(model_id):
+    return model_id.startswith("amazon.titan-embed-text")
+
+
+def build_text_embedding_body(model_id, texts):
+    if is_titan_text_model(model_id):
+        (text,) = texts
+        return {"inputText": text, "dimensions": TEXT_EMBEDDING_DIMENSION, "normalize": True}
+    return {
+        "texts": [text[:COHERE_MAX_CHARACTERS] for text in texts],
+        "input_type": "search_document",
+    }
+
+
+def parse_text_embeddings(model_id, response_body):
+    if is_titan_text_model(model_id):
+        return [response_body.get("embedding")]
+    return response_body.get("embeddings")
+
+
+def build_image_embedding_body(base64_image):
+    return {"inputImage": base64_image}
+
+
+def invoke_text_embeddings(bedrock_client, model_id, texts):
+    response = bedrock_client.invoke_model(
+        body=json.dumps(build_text_embedding_body(model_id, texts)),
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+    )
+    return parse_text_embeddings(model_id, json.loads(response["body"].read()))
+
+
+def invoke_image_embedding(bedrock_client, model_id, base64_image):
+    response = bedrock_client.invoke_model(
+        body=json.dumps(build_image_embedding_body(base64_image)),
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+    )
+    return json.loads(response["body"].read()).get("embedding")
+
+
+def embed_frame(bedrock_client, cache, model_id, frame_bytes):
+    """Titan image embedding of a frame, cached on the frame bytes."""
+    return cache.get_or_compute(
+        make_cache_key(model_id, IMAGE_EMBEDDING_DIMENSION, frame_bytes),
+        lambda: invoke_image_embedding(
+            bedrock_client, model_id, base64.b64encode(frame_bytes).decode()
+        ),
+    )
+
+
+def embed_texts(bedrock_client, model_id, texts, max_workers=DEFAULT_EMBEDDING_WORKERS):
+    """Embeds texts in order with bounded concurrency.
+
+    Cohere models take up to COHERE_MAX_TEXTS texts per request; Titan text
+    models take one, so each text becomes its own concurrent request.
+    """
+    if not texts:
+        return []
+    batch_size = 1 if is_titan_text_model(model_id) else COHERE_MAX_TEXTS
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        results = executor.map(
+            lambda batch: invoke_text_embeddings(bedrock_client, model_id, batch), batches
+        )
+        return [embedding for batch in results for embedding in batch]
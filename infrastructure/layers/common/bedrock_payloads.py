@@ -0,0 +1,112 @@
+"""Prompts and model payloads shared by the online pipeline and batch backfill.
+
+generate_shot_desc and embedding_aoss build their Bedrock requests here so
+that Bedrock batch inference records use exactly the same prompts and
+payload shapes as the synchronous calls.
+"""
+
+import base64
+
+from bedrock_embeddings import (
+    build_image_embedding_body,
+    build_text_embedding_body,
+    parse_text_embeddings,
+)
+
+SHOT_DESCRIPTION_MAX_TOKENS = 512
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+
+SHOT_DESCRIPTION_PROMPT = """Provide a detailed but concise description of a video shot based on the given frame images. Focus on creating a cohesive narrative of the entire shot rather than describing each frame individually. If the images contain frames from multiple shots, concentrate on describing the most prominent or central shot.
+
+        Before describing the shot:
+
+        - Identify the primary shot among the given frames.
+        - Disregard any frames that appear to belong to previous or next shots.
+        - If uncertain about which frames belong to the current shot, describe only the elements that are consistent across multiple frames.
+        
+        Then, incorporate the following elements in your description: 
+        1. Visual elements:
+        - Describe all visible objects, text, and characters in detail.
+        - For any characters present, include:
+            • Age
+            • Emotional expressions
+            • Clothing and accessories
+            • Physical appearance
+            • Any actions, movements or gestures
+
+        2. Setting and atmosphere:
+        - Provide details about the time, location, and overall ambiance.
+        - Mention any relevant background elements that contribute to the scene.
+
+        3. Incorporate provided information:
+        - Seamlessly integrate details about public figures and private figures if available.
+        - If this information is not provided, rely solely on the visual elements.
+
+        Skip the preamble; go straight into the description."""
+
+
+def build_shot_description_prompt(shot_frames):
+    prompt = SHOT_DESCRIPTION_PROMPT
+    for index, value in enumerate(shot_frames):
+        prompt += (
+            f"Frame {index}: Public figures: {value['frame_publicFigures']}; "
+            f"Private figures: {value['frame_privateFigures']}\n"
+        )
+    return prompt
+
+
+def build_converse_message(prompt, images):
+    """Converse API message with the prompt followed by the PNG frames."""
+    message = {"role": "user", "content": [{"text": prompt}]}
+    for image_content in images:
+        message["content"].append(
+            {"image": {"format": "png", "source": {"bytes": image_content}}}
+        )
+    return message
+
+
+def build_description_model_input(model_id, prompt, images):
+    """InvokeModel body equivalent to the converse call, for batch inference."""
+    encoded_images = [base64.b64encode(image).decode() for image in images]
+    if "anthropic." in model_id:
+        content = [{"type": "text", "text": prompt}]
+        for encoded_image in encoded_images:
+            content.append(
+                {
+                    "type": "image",
+                    "source": {"type": "base64", "media_type": "image/png", "data": encoded_image},
+                }
+            )
+        return {
+            "anthropic_version": ANTHROPIC_VERSION,
+            "max_tokens": SHOT_DESCRIPTION_MAX_TOKENS,
+            "messages": [{"role": "user", "content": content}],
+        }
+    if "amazon.nova" in model_id:
+        content = [{"text": prompt}]
+        for encoded_image in encoded_images:
+            content.append({"image": {"format": "png", "source": {"bytes": encoded_image}}})
+        return {
+            "schemaVersion": "messages-v1",
+            "messages": [{"role": "user", "content": content}],
+            "inferenceConfig": {"max_new_tokens": SHOT_DESCRIPTION_MAX_TOKENS},
+        }
+    raise ValueError(f"Batch shot descriptions are not supported for {model_id}")
+
+
+def parse_description_model_output(model_id, model_output):
+    if "anthropic." in model_id:
+        return model_output["content"][0]["text"]
+    return model_output["output"]["message"]["content"][0]["text"]
+
+
+def build_embedding_model_input(model_id, text=None, base64_image=None):
+    if base64_image is not None:
+        return build_image_embedding_body(base64_image)
+    return build_text_embedding_body(model_id, [text])
+
+
+def parse_embedding_model_output(model_id, model_output, is_image=False):
+    if is_image:
+        return model_output.get("embedding")
+    return parse_text_embeddings(model_id, model_output)[0]
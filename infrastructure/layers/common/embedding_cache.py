@@ -0,0 +1,190 @@
+"""Two-tier cache for embeddings and other model results.
+
+Entries are keyed by model id, a version (the embedding dimensions, or a
+prompt or request version) and the SHA-256 of the content, so the search
+function and the ingestion functions share one key scheme and one table.
+The first tier is an LRU held in the Lambda container and survives warm
+invocations; the optional shared tier is the cache table, with TTL enabled
+on ExpiresAt. Embeddings are stored as float32 bytes and other results as
+zlib-compressed JSON.
+"""
+
+import array
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+DEFAULT_FRAME_CACHE_TTL_SECONDS = 30 * 86400
+FRAME_CACHE_MAX_ENTRIES = 4096
+# Item attribute per codec; search embeddings were stored as Embedding first
+VALUE_ATTRIBUTES = {"float32": "Embedding", "json": "Value"}
+
+
+def normalize_query_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_cache_key(model_id, version, content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    digest = hashlib.sha256(content).hexdigest()
+    return f"{model_id}#{version}#{digest}"
+
+
+def prompt_version(prompt):
+    # Editing a prompt changes its version and so invalidates earlier answers
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_value(value, codec="float32"):
+    if codec == "float32":
+        return array.array("f", value).tobytes()
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_value(data, codec="float32"):
+    if codec == "float32":
+        values = array.array("f")
+        values.frombytes(data)
+        return values.tolist()
+    return json.loads(zlib.decompress(data))
+
+
+class LocalCacheStore:
+    """In-memory stand-in for the shared tier, bounded by TTL and entry count."""
+
+    def __init__(self, max_entries=10000, ttl_seconds=86400):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.time() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+
+class DynamoDBCacheStore:
+    """Shared tier backed by a DynamoDB table with TTL enabled on ExpiresAt."""
+
+    def __init__(self, table, ttl_seconds=86400, codec="float32"):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.codec = codec
+        self.attribute = VALUE_ATTRIBUTES[codec]
+
+    def get(self, key):
+        try:
+            item = self.table.get_item(Key={"CacheKey": key}).get("Item")
+        except ClientError as e:
+            logging.error(f"Cache read failed: {e}")
+            return None
+        # TTL deletion is lazy, so expired items can still be returned
+        if item is None or self.attribute not in item or int(item["ExpiresAt"]) < time.time():
+            return None
+        return decode_value(item[self.attribute].value, self.codec)
+
+    def put(self, key, value):
+        try:
+            self.table.put_item(
+                Item={
+                    "CacheKey": key,
+                    self.attribute: encode_value(value, self.codec),
+                    "ExpiresAt": int(time.time() + self.ttl_seconds),
+                }
+            )
+        except ClientError as e:
+            logging.error(f"Cache write failed: {e}")
+
+
+class EmbeddingCache:
+    """Two-tier cache of embeddings, or of other model results with the json codec.
+
+    The shared tier is consulted on a local miss.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, shared_store=None):
+        self.local_store = LocalCacheStore(max_entries, ttl_seconds)
+        self.shared_store = shared_store
+        self._counters = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get_or_compute(self, key, compute):
+        embedding = self.local_store.get(key)
+        if embedding is not None:
+            self._count("local_hits")
+            return embedding
+
+        if self.shared_store is not None:
+            embedding = self.shared_store.get(key)
+            if embedding is not None:
+                self._count("shared_hits")
+                self.local_store.put(key, embedding)
+                return embedding
+
+        self._count("misses")
+        embedding = compute()
+        self.local_store.put(key, embedding)
+        if self.shared_store is not None:
+            self.shared_store.put(key, embedding)
+        return embedding
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = sum(counters.values())
+        # Every hit is a Bedrock round trip that was not made
+        counters["bedrock_calls_saved"] = counters["local_hits"] + counters["shared_hits"]
+        counters["hit_rate"] = (
+            counters["bedrock_calls_saved"] / lookups if lookups else 0.0
+        )
+        return counters
+
+
+def create_cache(table_name, ttl_seconds, max_entries, codec="float32"):
+    # Imported here so that the cache can be used without AWS credentials
+    from aws_clients import get_resource
+
+    shared_store = None
+    if table_name:
+        shared_store = DynamoDBCacheStore(
+            get_resource("dynamodb").Table(table_name), ttl_seconds, codec
+        )
+    return EmbeddingCache(max_entries, ttl_seconds, shared_store)
+
+
+def create_frame_cache(codec="float32"):
+    """Cache for the per-frame results of the ingestion functions."""
+    return create_cache(
+        os.environ.get("memo_cache_table"),
+        int(os.environ.get("memo_cache_ttl_seconds", DEFAULT_FRAME_CACHE_TTL_SECONDS)),
+        FRAME_CACHE_MAX_ENTRIES,
+        codec,
+    )
@@ -0,0 +1,89 @@
+"""Per-job frame vector files for cross-frame identity matching.
+
+create_shot_collection embeds every frame with a detected public or private
+figure and writes one small vector file per shot. Once all shots are done
+the files are merged into a single job file, which generate_shot_desc loads
+once per container and matches frames against with a matrix product.
+"""
+
+import io
+import json
+
+import numpy as np
+
+# Same cut-off as the k-NN score the per-job AOSS index used to return
+FRAME_MATCH_SCORE = 0.8
+MAX_FRAME_MATCHES = 100
+
+
+def shot_vectors_key(jobId, shot_id):
+    return f"{jobId}/frame_vectors/{shot_id}.npz"
+
+
+def job_vectors_key(jobId):
+    return f"{jobId}/frame_vectors.npz"
+
+
+def score_to_cosine(score):
+    # The nmslib cosinesimil score is 1 / (2 - cosine)
+    return 2.0 - 1.0 / score
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def encode_frame_vectors(frames, vectors):
+    """Serializes frame metadata and their unit-length embeddings as .npz bytes."""
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        frames=np.array(json.dumps(frames)),
+        vectors=normalize(vectors) if frames else np.zeros((0, 0), dtype=np.float32),
+    )
+    return buffer.getvalue()
+
+
+def decode_frame_vectors(data):
+    with np.load(io.BytesIO(data)) as npz:
+        return json.loads(str(npz["frames"])), npz["vectors"]
+
+
+def merge_frame_vectors(parts):
+    """Concatenates (frames, vectors) parts into one encoded job file."""
+    parts = [(frames, vectors) for frames, vectors in parts if frames]
+    if not parts:
+        return encode_frame_vectors([], [])
+    frames = [frame for part_frames, _ in parts for frame in part_frames]
+    return encode_frame_vectors(frames, np.vstack([vectors for _, vectors in parts]))
+
+
+class FrameVectors:
+    def __init__(self, frames, vectors):
+        self.frames = frames
+        self.vectors = vectors
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(*decode_frame_vectors(data))
+
+    def match(self, embedding, min_score=FRAME_MATCH_SCORE, k=MAX_FRAME_MATCHES):
+        """Frames whose similarity to embedding scores at least min_score, best first."""
+        return self.match_many([embedding], min_score, k)[0]
+
+    def match_many(self, embeddings, min_score=FRAME_MATCH_SCORE, k=MAX_FRAME_MATCHES):
+        """Matches a batch of embeddings with a single matrix product."""
+        if not self.frames or not len(embeddings):
+            return [[] for _ in embeddings]
+        similarities = normalize(embeddings) @ self.vectors.T
+        min_cosine = score_to_cosine(min_score)
+        matches = []
+        for row_similarities in similarities:
+            rows = np.flatnonzero(row_similarities >= min_cosine)
+            rows = rows[np.argsort(-row_similarities[rows], kind="stable")][:k]
+            matches.append([self.frames[row] for row in rows])
+        return matches
@@ -0,0 +1,224 @@
+"""Token-bucket rate limits shared by every Lambda container.
+
+Each bucket is one item of the rate control table, keyed by the API and,
+when the request names one, the model id, for example
+"rate:bedrock-runtime:Converse:<model id>". Buckets refill at a fixed rate
+up to a burst size, and every call takes one token, waiting briefly for it
+when the bucket is empty rather than being throttled and retried. Items are
+updated with a condition on their last update, so concurrent containers
+never take the same token.
+
+Limits come from the rate_limits environment variable as JSON, for example
+{"bedrock-runtime:Converse": {"rate": 3, "burst": 10}}, in tokens per
+second. A limit can name a service, a service and operation, or a service,
+operation and model id; the most specific one applies. aws_clients installs
+the limiter on the clients of limited services. The bucket is picked from
+the API params before they are serialized, and a token is taken before each
+attempt is sent, so botocore's own retries are limited too.
+
+A container takes up to rate_limit_token_batch tokens per round trip to the
+table and spends them locally for a short while, so the bucket items are
+not read and written on every call. When the table cannot be reached the
+calls go ahead unlimited, with a log.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Past this wait the call goes ahead, so a stuck table never stalls a job
+MAX_WAIT_SECONDS = 60
+MIN_WAIT_SECONDS = 0.05
+DEFAULT_TOKEN_BATCH = 5
+# Tokens a container took but did not spend are dropped after this long, so
+# an idle container does not hold on to them
+RESERVE_SECONDS = 2.0
+
+
+def load_rate_limits():
+    return json.loads(os.environ.get("rate_limits") or "{}")
+
+
+def refill(tokens, updated_at, now, rate, burst):
+    return min(float(burst), float(tokens) + max(0.0, now - float(updated_at)) * rate)
+
+
+class LocalTokenBucketStore:
+    """In-memory buckets for tests and single-container use."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now, count=1):
+        """Takes up to count tokens.
+
+        Returns the tokens taken and the seconds until one is available.
+        """
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated_at, now, rate, burst)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return 0, (1 - tokens) / rate
+            taken = min(count, int(tokens))
+            self._buckets[key] = (tokens - taken, now)
+            return taken, 0.0
+
+
+class DynamoDBTokenBucketStore:
+    """Buckets in the rate control table, shared by every container."""
+
+    def __init__(self, table_name):
+        # Imported here so that aws_clients can import this module lazily
+        from aws_clients import get_resource
+
+        self.table = get_resource("dynamodb").Table(table_name)
+
+    def take(self, key, rate, burst, now, count=1):
+        """Takes up to count tokens.
+
+        Returns the tokens taken and the seconds until one is available.
+        """
+        item = self.table.get_item(
+            Key={"ControlKey": key}, ConsistentRead=True
+        ).get("Item")
+        if item is None:
+            tokens = refill(burst, now, now, rate, burst)
+            condition = {"ConditionExpression": "attribute_not_exists(ControlKey)"}
+        else:
+            tokens = refill(item["Tokens"], item["UpdatedAt"], now, rate, burst)
+            condition = {
+                "ConditionExpression": "UpdatedAt = :previous",
+                "ExpressionAttributeValues": {":previous": item["UpdatedAt"]},
+            }
+        if tokens < 1:
+            return 0, (1 - tokens) / rate
+        taken = min(count, int(tokens))
+        try:
+            self.table.put_item(
+                Item={
+                    "ControlKey": key,
+                    # DynamoDB numbers go through boto3 as Decimal
+                    "Tokens": Decimal(str(round(tokens - taken, 6))),
+                    "UpdatedAt": Decimal(str(round(now, 6))),
+                },
+                **condition,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            # Another container took a token first; try again right away
+            return 0, MIN_WAIT_SECONDS
+        return taken, 0.0
+
+
+class RateLimiter:
+    def __init__(self, store, limits, token_batch=DEFAULT_TOKEN_BATCH):
+        self.store = store
+        self.limits = limits
+        self.token_batch = token_batch
+        # key -> [tokens taken from the table but not spent yet, expiry]
+        self._reserve = {}
+        self._reserve_lock = threading.Lock()
+
+    def limit_for(self, service, operation, model_id=None):
+        for name in (f"{service}:{operation}:{model_id}", f"{service}:{operation}", service):
+            if name in self.limits:
+                return self.limits[name]
+        return None
+
+    def limits_service(self, service):
+        return any(name.split(":")[0] == service for name in self.limits)
+
+    def acquire(self, service, operation, model_id=None):
+        """Waits for a token; returns the seconds waited."""
+        limit = self.limit_for(service, operation, model_id)
+        if limit is None:
+            return 0.0
+        key = ":".join(["rate", service, operation] + ([model_id] if model_id else []))
+        rate, burst = float(limit["rate"]), float(limit.get("burst", limit["rate"]))
+        start = time.time()
+        if self._spend_reserved(key, start):
+            return 0.0
+        # A bucket never holds more than its burst
+        count = max(1, min(self.token_batch, int(burst)))
+        while True:
+            now = time.time()
+            try:
+                taken, wait = self.store.take(key, rate, burst, now, count)
+            except (BotoCoreError, ClientError) as e:
+                logging.error(f"Rate limiter failed for {key}, calling without a token: {e}")
+                return now - start
+            if taken:
+                self._add_reserved(key, taken - 1, now)
+                return now - start
+            if now - start + wait > MAX_WAIT_SECONDS:
+                logging.warning(f"No token for {key} within {MAX_WAIT_SECONDS} s; calling anyway")
+                return now - start
+            time.sleep(max(wait, MIN_WAIT_SECONDS))
+
+    def _spend_reserved(self, key, now):
+        with self._reserve_lock:
+            reserve = self._reserve.get(key)
+            if reserve is None or reserve[0] < 1 or reserve[1] < now:
+                return False
+            reserve[0] -= 1
+            return True
+
+    def _add_reserved(self, key, tokens, now):
+        with self._reserve_lock:
+            reserve = self._reserve.get(key)
+            if reserve is not None and reserve[1] >= now:
+                tokens += reserve[0]
+            self._reserve[key] = [tokens, now + RESERVE_SECONDS]
+
+    def before_parameter_build(self, params, model, context, **kwargs):
+        """Notes which bucket the call draws from while its API params are at hand."""
+        context["rate_limit"] = (
+            model.service_model.service_name,
+            model.name,
+            params.get("modelId"),
+        )
+
+    def before_send(self, request, **kwargs):
+        """botocore before-send hook, so every attempt, retries included, takes a token.
+
+        Returning None lets the request go out.
+        """
+        target = (request.context or {}).get("rate_limit")
+        if target is not None:
+            self.acquire(*target)
+        return None
+
+    def install(self, client):
+        if self.limits_service(client.meta.service_model.service_name):
+            client.meta.events.register("before-parameter-build", self.before_parameter_build)
+            client.meta.events.register("before-send", self.before_send)
+        return client
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The container's limiter, or None without a table or limits."""
+    global _limiter
+    table_name = os.environ.get("rate_control_table")
+    limits = load_rate_limits()
+    if not table_name or not limits:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter(
+                DynamoDBTokenBucketStore(table_name),
+                limits,
+                int(os.environ.get("rate_limit_token_batch", DEFAULT_TOKEN_BATCH)),
+            )
+        return _limiter
@@ -0,0 +1,102 @@
+"""Shot manifests and shot batches for the Distributed Map states.
+
+Shot detection writes every shot as one line of a JSONL manifest in the
+shots bucket. Both shot maps read the manifest with an ItemReader and hand
+the shots to the per-shot functions in ItemBatcher batches, which arrive as
+{"Items": [...]}.
+
+Once the first map is done, the shots it finished, the ones with a shot
+record, are written to a second manifest that the second map reads, so
+shots that failed within the tolerated failures are not described.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SHOT_BATCH_WORKERS = 5
+
+
+def shot_manifest_key(jobId):
+    return f"{jobId}/shots.jsonl"
+
+
+def detected_shots_manifest_key(jobId):
+    return f"{jobId}/detected_shots.jsonl"
+
+
+def encode_shot_manifest(shots):
+    return "".join(json.dumps(shot) + "\n" for shot in shots).encode("utf-8")
+
+
+def read_shot_manifest(s3_client, bucket, key):
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    for line in body.iter_lines():
+        if line:
+            yield json.loads(line)
+
+
+def shot_items(event):
+    """Returns the shots of an event and whether they came as a batch.
+
+    A batch is the {"Items": [...]} payload of a Map state ItemBatcher or a
+    plain list; anything else is a single shot.
+    """
+    if isinstance(event, list):
+        return event, True
+    if "Items" in event:
+        return event["Items"], True
+    return [event], False
+
+
+class ShotBatchError(Exception):
+    """Some shots of a batch failed; raised once all of them have run."""
+
+
+def run_shot_batch(process_shot, shots, max_workers=None):
+    """Runs process_shot on every shot, carrying on past failed ones.
+
+    Returns the results in order, None for a failed shot, and a list of
+    (shot, exception) for the failures.
+    """
+    if max_workers is None:
+        max_workers = int(os.environ.get("shot_batch_workers", DEFAULT_SHOT_BATCH_WORKERS))
+    if not shots:
+        return [], []
+
+    def run(shot):
+        try:
+            return process_shot(shot), None
+        except Exception as e:
+            logging.exception(f"Shot {shot.get('shot_id', shot.get('shot_startTime'))} failed")
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(shots)))) as executor:
+        outcomes = list(executor.map(run, shots))
+    failures = [(shot, error) for shot, (_, error) in zip(shots, outcomes) if error is not None]
+    return [result for result, _ in outcomes], failures
+
+
+def raise_failures(failures, count):
+    """Fails the batch, so the Map state retries it, once the other shots are saved."""
+    if failures:
+        raise ShotBatchError(
+            f"{len(failures)} of {count} shots failed, first: {failures[0][1]!r}"
+        ) from failures[0][1]
+
+
+def map_shots(process_shot, event, max_workers=None):
+    """Runs process_shot on every shot of the event.
+
+    A single shot gets its result back as is and a batch gets
+    {"Items": [...]} with the results in order. A failed shot fails the
+    batch only after the other shots have finished, so their outputs are
+    kept and they are carried into the second map.
+    """
+    shots, is_batch = shot_items(event)
+    if not is_batch:
+        return process_shot(shots[0])
+    results, failures = run_shot_batch(process_shot, shots, max_workers)
+    raise_failures(failures, len(shots))
+    return {"Items": results}
@@ -0,0 +1,90 @@
+"""Visual index documents for shots, shared by ingestion and backfill."""
+
+from aoss_bulk import bulk_delete, bulk_index
+
+# Shots looked up per search; stays well under the boolean clause limit
+SHOT_LOOKUP_CHUNK = 500
+# Room for the duplicates of shots indexed several times before
+MAX_DOCUMENTS_PER_SHOT = 10
+
+
+def find_shot_document_ids(client, index, shots):
+    """IDs of the documents already indexed for the given shots.
+
+    Shots are identified by jobId and shot_id, so the same video uploaded as
+    another job keeps its own documents. Both fields are analyzed text, so
+    the hits of the phrase queries are checked for exact values.
+    """
+    shot_ids_by_job = {}
+    for shot in shots:
+        shot_ids_by_job.setdefault(shot["jobId"], set()).add(shot["shot_id"])
+
+    document_ids = []
+    for jobId, shot_ids in shot_ids_by_job.items():
+        shot_ids = sorted(shot_ids)
+        for start in range(0, len(shot_ids), SHOT_LOOKUP_CHUNK):
+            chunk = shot_ids[start : start + SHOT_LOOKUP_CHUNK]
+            response = client.search(
+                index=index,
+                body={
+                    "size": len(chunk) * MAX_DOCUMENTS_PER_SHOT,
+                    "_source": ["jobId", "shot_id"],
+                    "query": {
+                        "bool": {
+                            "filter": [{"match_phrase": {"jobId": jobId}}],
+                            "should": [
+                                {"match_phrase": {"shot_id": shot_id}} for shot_id in chunk
+                            ],
+                            "minimum_should_match": 1,
+                        }
+                    },
+                },
+            )
+            document_ids += [
+                hit["_id"]
+                for hit in response["hits"]["hits"]
+                if hit["_source"].get("jobId") == jobId
+                and hit["_source"].get("shot_id") in chunk
+            ]
+    return document_ids
+
+
+def replace_shot_documents(client, index, shots, documents):
+    """Indexes documents in place of any indexed before for the same shots.
+
+    The collection assigns document IDs, so a retried or re-run ingestion
+    deletes what earlier attempts indexed instead of overwriting it by ID.
+    Returns the positions of documents that could not be indexed.
+    """
+    document_ids = find_shot_document_ids(client, index, shots)
+    if document_ids:
+        failed = bulk_delete(client, index, document_ids)
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)} of {len(document_ids)} earlier shot documents were not deleted"
+            )
+    return bulk_index(client, index, documents)
+
+
+def build_shot_document(
+    shot, shot_desc_embedding, shot_image_embedding, shot_transcript_embedding
+):
+    document = {
+        "jobId": shot["jobId"],
+        "video_name": shot["video_name"],
+        "shot_id": shot["shot_id"],
+        "shot_startTime": shot["shot_startTime"],
+        "shot_endTime": shot["shot_endTime"],
+        "shot_description": shot["shot_description"],
+        "shot_publicFigures": shot["shot_publicFigures"],
+        "shot_privateFigures": shot["shot_privateFigures"],
+        "shot_transcript": shot["shot_transcript"],
+        "shot_image_vector": shot_image_embedding,
+    }
+    # Empty fields are not embedded, e.g. shots without speech are indexed
+    # without a transcript vector
+    if shot_desc_embedding is not None:
+        document["shot_desc_vector"] = shot_desc_embedding
+    if shot_transcript_embedding is not None:
+        document["shot_transcript_vector"] = shot_transcript_embedding
+    return document
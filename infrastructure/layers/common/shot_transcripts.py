@@ -0,0 +1,43 @@
+"""Assigns transcript sentences to shots with a sorted interval index.
+
+The job's transcript is indexed once after transcription and shot detection
+finish, and each shot's slice is stored next to the shot record, so the
+per-shot functions never download or scan the full transcript.
+"""
+
+import bisect
+
+# A sentence belongs to a shot when at least this much of it falls inside
+MIN_OVERLAP_MS = 500
+
+
+def shot_id_for(shot_startTime, shot_endTime):
+    return f"{shot_startTime}-{shot_endTime}"
+
+
+def shot_transcript_key(jobId, shot_id):
+    return f"{jobId}/shot_transcripts/{shot_id}.txt"
+
+
+class TranscriptIndex:
+    def __init__(self, transcript):
+        self.sentences = sorted(transcript, key=lambda item: item["sentence_startTime"])
+        self.starts = [item["sentence_startTime"] for item in self.sentences]
+        # Running maximum of end times, so sentences ending before a shot can
+        # be skipped with a bisect even when sentences overlap
+        self.max_ends = []
+        max_end = float("-inf")
+        for item in self.sentences:
+            max_end = max(max_end, item["sentence_endTime"])
+            self.max_ends.append(max_end)
+
+    def shot_transcript(self, shot_startTime, shot_endTime):
+        first = bisect.bisect_right(self.max_ends, shot_startTime)
+        last = bisect.bisect_left(self.starts, shot_endTime)
+        relevant_transcript = ""
+        for item in self.sentences[first:last]:
+            delta_start = max(item["sentence_startTime"], shot_startTime)
+            delta_end = min(item["sentence_endTime"], shot_endTime)
+            if delta_end - delta_start >= MIN_OVERLAP_MS:
+                relevant_transcript += item["sentence"] + "; "
+        return relevant_transcript